@@ -0,0 +1,118 @@
+"""
+================================================================================
+ Bank Format Registry
+================================================================================
+ Description:  Declarative descriptions of the statement exports Auto-Tax can
+               read. A format is identified from the header line alone (the
+               first few KB of the file), and the matching entry drives one
+               typed normalization path into the canonical columns below.
+
+ Canonical columns:
+   Details, Posting Date, Description, Amount, Type, Balance, Check
+
+ Adding a bank:
+ - Add a dict to BANK_FORMATS with 'name', 'label', 'columns' (export
+   column → canonical column) and 'amount' ('Amount' or a (debit, credit)
+   pair). More specific formats go first; a format matches when every
+   column it lists is present in the header.
+
+================================================================================
+"""
+
+
+import io
+import csv
+
+CANONICAL_COLUMNS = ['Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance', 'Check']
+
+BANK_FORMATS = [
+    {
+        'name': 'chase_checking',
+        'label': 'Chase checking',
+        'columns': {
+            'Details': 'Details',
+            'Posting Date': 'Posting Date',
+            'Description': 'Description',
+            'Amount': 'Amount',
+            'Type': 'Type',
+            'Balance': 'Balance',
+            'Check or Slip #': 'Check',
+        },
+        'amount': 'Amount',
+    },
+    {
+        'name': 'chase_card',
+        'label': 'Chase credit card',
+        'columns': {
+            'Transaction Date': None,
+            'Post Date': 'Posting Date',
+            'Description': 'Description',
+            'Category': None,
+            'Type': 'Type',
+            'Amount': 'Amount',
+        },
+        'amount': 'Amount',
+    },
+    {
+        'name': 'debit_credit',
+        'label': 'Generic Debit/Credit',
+        'columns': {
+            'Date': 'Posting Date',
+            'Description': 'Description',
+            'Debit': None,
+            'Credit': None,
+        },
+        'amount': ('Debit', 'Credit'),
+    },
+    {
+        'name': 'generic_amount',
+        'label': 'Generic Date/Description/Amount',
+        'columns': {
+            'Date': 'Posting Date',
+            'Description': 'Description',
+            'Amount': 'Amount',
+        },
+        'amount': 'Amount',
+    },
+]
+
+
+def identify_bank_format(header):
+    """Return the first registered format whose columns are all in the header, or None."""
+    header = [str(col).strip() for col in header]
+    for bank_format in BANK_FORMATS:
+        if all(col in header for col in bank_format['columns']):
+            return bank_format
+    return None
+
+
+def sniff_bank_format(transaction_file_name, sample_bytes=4096, encoding='utf-8'):
+    """Identify a statement's format from its first few KB.
+
+    Returns (bank_format or None, header, has_extra_column). has_extra_column is True
+    when data rows carry one more (empty) field than the header, as Chase exports do.
+    """
+    with open(transaction_file_name, 'rb') as file:
+        raw = file.read(sample_bytes)
+    lines = raw.decode(encoding, errors='replace').lstrip('\ufeff').splitlines()
+
+    # Only trust complete lines; the sample may end mid-row
+    if len(raw) == sample_bytes and len(lines) > 1:
+        lines = lines[:-1]
+
+    rows = list(csv.reader(io.StringIO('\n'.join(lines[:2]))))
+    header = [col.strip() for col in rows[0]] if rows else []
+    first_row = rows[1] if len(rows) > 1 else []
+    has_extra_column = len(first_row) == len(header) + 1 and first_row[-1] == ''
+
+    return identify_bank_format(header), header, has_extra_column
+
+
+def source_columns(bank_format):
+    """Export columns that the format needs to read."""
+    columns = list(bank_format['columns'])
+    amount = bank_format['amount']
+    for col in (amount if isinstance(amount, tuple) else (amount,)):
+        if col not in columns:
+            columns.append(col)
+    return columns
@@ -1,38 +1,16 @@
 import os
 import pandas as pd
 from tkinter import filedialog, Tk
+from map_expense import load_transactions, normalize_transactions, format_amounts
+from bank_formats import CANONICAL_COLUMNS, identify_bank_format
 
-def import_data(transaction_file_name):
+def import_data(transaction_file_name, engine='auto'):
     print('Import Data:')
-    # Read the actual header row (first row) separately using nrows=1
-    header_row = pd.read_csv(transaction_file_name, header=None, nrows=1)
-
-    # Extract the column names from the first row
-    header_row = header_row.iloc[0].tolist()  # Get the first row as a list of column names
-
-    # Check number of columns in header_row and the DataFrame
-    print(f"Header row has {len(header_row)} columns")
-    print(f"DataFrame has {len(header_row)} columns before setting the columns")
-
-    print('read data:')
-    # Read the CSV file without a header, skip the first row (skiprows=1)
-    try:
-        # Read the CSV file with error handling to skip bad rows
-        df = pd.read_csv(transaction_file_name, header=None, skiprows=1, on_bad_lines='skip')
-        print("Data read successfully!")
-    except Exception as e:
-        print(f"Error reading file: {e}")
-
-    # Verify the number of columns in df
-    # print(f"DataFrame has {df.shape[1]} columns")
-
-    # Drop the last column if it doesn't match the header (extra column)
-    if len(df.columns) > len(header_row):
-        df = df.iloc[:, :-1]  # Remove the last column if it exceeds the header length
-
-    # Set the column names from the header_row list
-    df.columns = header_row
-
+    # load_transactions sniffs the bank format from the header, reads only the columns
+    # that format needs (multithreaded Arrow reader when pyarrow is installed) and
+    # returns the canonical columns with Amount in int64 cents
+    df = load_transactions(transaction_file_name, engine=engine)
+    print(f"DataFrame has {len(df.columns)} columns")
 
     # Print the DataFrame structure
     # print_df_structure(df)
@@ -41,67 +19,22 @@ def import_data(transaction_file_name):
 
 
 def preprocess_file(df):
-    """Load and preprocess the CSV file into DataFrame 1 and then create DataFrame 2."""
-    # global df_2
+    """Normalize a raw export DataFrame into the canonical columns of its bank format."""
     print('Pre Process File:')
-    
-    # Step 2: Create a new DataFrame 2 with the desired column headings
-    # desired_columns = ["Details", "Posting Date", "Description", "Amount", "Type", "Balance", "Check", "KEY"]
-    desired_columns = ["Details", "Posting Date", "Description", "Amount", "Type", "Balance", "Check"]
-    
-    # Step 3: Initialize DataFrame 2 with empty columns
-    df_2 = pd.DataFrame(columns=desired_columns)
-    # print(df_2.columns.to_list())
-
-    # Step 4: Create a mapping structure to map columns from DataFrame 1 to DataFrame 2
-    column_mapping = {
-        "Date": "Posting Date",       # Map Date to Posting Date
-        "Description": "Description", # Direct mapping
-    }
-
-    # Step 5: Populate DataFrame 2 with values from DataFrame 1 using the mapping
-    for original_col, target_col in column_mapping.items():
-        # print(f' original_col: {original_col}, target_col: {target_col}')
-        if original_col in df.columns:
-            df_2[target_col] = df[original_col]
-        else:
-            print(f"Warning: {original_col} not found in DataFrame 1.")
-
-
-    # Step 6: Handle the Amount column by checking if there's a Debit value
-    for i, row in df.iterrows():
-        if pd.notnull(row['Debit']):  # If Debit has a value
-            df_2.at[i, 'Amount'] = row['Debit']
-        elif pd.notnull(row['Credit']):  # If Debit is empty, use Credit
-            df_2.at[i, 'Amount'] = -row['Credit']  # Make Credit negative for Amount
-
-    # # Step 7: Ensure Amount column is numeric and handle errors gracefully
-    # df_2['Amount'] = pd.to_numeric(df_2['Amount'], errors='coerce')  # Convert to numeric, coercing errors to NaN
-
-    # # Step 8: Add handling for 'Check' (if applicable)
-    # df_2['Check'] = df_2.get('Check', 'N/A')  # If there's no Check, default to 'N/A'
-
 
-    # Print the final structure and check if rows are added
-    for x in range(5):
-        print('.')
-    print("df_2 structure after preprocessing:")
-    print_df_structure(df_2)
+    # Frames from import_data are already normalized
+    if list(df.columns) == CANONICAL_COLUMNS:
+        return df
 
-    print('71 *************************')
-    # Step 5: Populate DataFrame 2 with values from DataFrame 1 using the mapping
-    for original_col, target_col in column_mapping.items():
-        print(f' original_col: {original_col}, target_col: {target_col}')
-        if original_col in df.columns:
-            df_2[target_col] = df[original_col]
-        else:
-            print(f"Warning: {original_col} not found in DataFrame 1.")
+    bank_format = identify_bank_format(df.columns)
+    if bank_format is None:
+        print(f"Warning: unrecognized columns {df.columns.tolist()}.")
+        return df
 
-    # Step 8: Add handling for 'Check' (if applicable) - You might want to handle 'Check' or 'Slip #' as required
-    df_2['Check'] = df_2.get('Check', 'N/A')  # If there's no Check, default to 'N/A'
+    print(f"Bank format: {bank_format['label']}")
+    df_2 = normalize_transactions(df, bank_format)
 
     print("Preprocessing complete.")
-    print("First few rows of df:")
     return df_2
 
 
@@ -181,6 +114,7 @@ def group_expenses(df):
     # expense_sum = e.query('Amount > 0')
     # Remove rows where the Amount is 0
     # expense_sum = e[e['Amount'] != 0]
+    e['Amount'] = e['Amount'].astype('Int64')  # Sums stay as exact integer cents
     expense_sum = e[e['Amount'].notna()]    #: This line filters out rows where the Amount is NaN.
     
     # Save the result to a CSV file in the same directory as the script
@@ -191,7 +125,7 @@ def group_expenses(df):
     print(save_path)
     
     # Save the DataFrame to the CSV file
-    expense_sum.to_csv(save_path)
+    format_amounts(expense_sum).to_csv(save_path)
     print("File saved successfully.")
 
 
@@ -228,11 +162,9 @@ if __name__ == "__main__":
     # transaction_file_name = "Chase0106_Activity_20250205.CSV"
     df = import_data(transaction_file_name)
 
-    # Check if both 'Debit' and 'Credit' columns are present
-    if 'Debit' in df.columns and 'Credit' in df.columns:
-        # If the file matches the new format, preprocess it
-        df = preprocess_file(df)
-        print('**************************  PRE PROCESSING IS COMPLETE')
+    # import_data already normalizes registered bank formats; this only matters for raw frames
+    df = preprocess_file(df)
+    print('**************************  PRE PROCESSING IS COMPLETE')
 
     # # Add a new column called 'KEY' with a default value or calculated values
     df['KEY'] = None  # You can replace 'default_value' with the value you want to assign to this column
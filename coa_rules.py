@@ -0,0 +1,358 @@
+r"""
+================================================================================
+ COA Rule Compiler
+================================================================================
+ Description:  Compiles Chart_Of_Accounts_Mappings.txt into one combined regex
+               so each description is scanned once, instead of once per rule.
+
+ Rule syntax (DESCRIPTION column):
+ - COSTCO WHSE          → plain substring, case sensitive (unchanged behaviour).
+ - ws:3250 W GRANTLINE RD TRACY
+                        → substring where any run of spaces matches any run
+                          of whitespace.
+ - re:^AMZN MKTP US\*   → Python regular expression, searched in the
+                          description (use ^ / $ to anchor).
+
+ Optional columns (add them to the header; blank means "any"):
+ - AMOUNT_MIN, AMOUNT_MAX → inclusive bounds on the statement's signed Amount.
+ - DETAILS, TYPE          → required Details / Type value(s), case
+                            insensitive, alternatives separated by '|'.
+
+ Priority:
+ - The first rule in file order whose pattern and conditions all hold wins,
+   exactly like the original row-by-row loop.
+ - Plain substring rules are combined into one prefix-trie regex with a named
+   group per rule; ws:/re: rules into one alternation (?P<r5>...)|(?P<r9>...)
+   ordered by rule number. At each position a match reports the
+   lowest-numbered rule matching there, so the minimum over all matching
+   positions is the first matching rule in file order.
+ - Rules with conditions are few; each is checked as one vectorized column
+   operation and only wins if it comes before the unconditional match.
+
+ Binary ruleset (utility/compile_COA.py):
+ - save_ruleset / load_ruleset store the checked, de-duplicated rules so the
+   mapper can skip parsing and validating the text file. Layout, little endian:
+     header  "ATXRULES", uint16 version, uint16 reserved, uint32 rule count,
+             32-byte SHA-256 of the source mappings file
+     record  int32 line, int32 expense, uint8 kind, uint8 flags (1 = has
+             AMOUNT_MIN, 2 = has AMOUNT_MAX), int64 amount_min, int64
+             amount_max, uint16 × 3 byte lengths, then the UTF-8 DESCRIPTION,
+             DETAILS and TYPE text.
+
+================================================================================
+"""
+
+
+import re
+import struct
+import hashlib
+from decimal import Decimal, InvalidOperation
+import numpy as np
+import pandas as pd
+
+CONDITION_COLUMNS = ['AMOUNT_MIN', 'AMOUNT_MAX', 'DETAILS', 'TYPE']
+
+_LEADING_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+RULESET_EXTENSION = '.rules'
+RULESET_MAGIC = b'ATXRULES'
+RULESET_VERSION = 1
+_HEADER = struct.Struct('<8sHHI32s')
+_RECORD = struct.Struct('<iiBBqqHHH')
+_KINDS = ['substring', 'ws', 'regex']
+
+
+def dollars_to_cents(value):
+    """Convert a rule's dollar bound to integer cents (None when blank)."""
+    if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == '':
+        return None
+    text = str(value).strip().replace(',', '').replace('$', '')
+    try:
+        return int((Decimal(text) * 100).to_integral_value())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount bound: {value!r}")
+
+
+def _to_choices(value):
+    """Parse a DETAILS/TYPE condition into a set of upper-case choices (None when blank)."""
+    if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == '':
+        return None
+    return {choice.strip().upper() for choice in str(value).split('|') if choice.strip()}
+
+
+def rule_pattern(description):
+    """Return (kind, regex source) for a DESCRIPTION cell."""
+    if description.startswith('re:'):
+        pattern = description[3:]
+        if '(?P<' in pattern or re.search(r'\\[1-9]', pattern):
+            raise ValueError(f"Regex rules may not use named groups or numbered backreferences: {description!r}")
+        # Global inline flags are only allowed at the start of the combined regex, so scope them
+        flags = _LEADING_FLAGS.match(pattern)
+        if flags:
+            pattern = f'(?{flags.group(1)}:{pattern[flags.end():]})'
+        re.compile(pattern)
+        return 'regex', pattern
+    if description.startswith('ws:'):
+        words = description[3:].split()
+        return 'ws', r'\s+'.join(re.escape(word) for word in words)
+    return 'substring', re.escape(description)
+
+
+def make_rule(line, expense, description, amount_min=None, amount_max=None, details=None, type_=None):
+    """Build one rule dict from a DESCRIPTION cell and its optional condition cells."""
+    kind, pattern = rule_pattern(description)
+    return {
+        'line': line,
+        'expense': expense,
+        'text': description,
+        'kind': kind,
+        'pattern': pattern,
+        'regex': re.compile(pattern),
+        'amount_min': dollars_to_cents(amount_min),
+        'amount_max': dollars_to_cents(amount_max),
+        'details': _to_choices(details),
+        'type': _to_choices(type_),
+    }
+
+
+def compile_coa(coa_df):
+    """Compile the COA mapping DataFrame into a ruleset dict used by match_rules."""
+    # load_coa indexes rules by file line; otherwise assume one line per row after the header
+    lines = coa_df.index if coa_df.index.name == 'LINE' else range(2, len(coa_df) + 2)
+    rules = []
+    for line, row in zip(lines, coa_df.itertuples(index=False)):
+        row = row._asdict()
+        description = row.get('DESCRIPTION')
+        if description is None or pd.isna(description):
+            continue
+        rules.append(make_rule(int(line), row['EXPENSE'], str(description), row.get('AMOUNT_MIN'),
+                               row.get('AMOUNT_MAX'), row.get('DETAILS'), row.get('TYPE')))
+    return build_ruleset(rules)
+
+
+def build_ruleset(rules):
+    """Number the rules in priority order and build the combined regexes."""
+    for index, rule in enumerate(rules):
+        rule['index'] = index
+        rule['conditional'] = any(rule[key] is not None for key in ('amount_min', 'amount_max', 'details', 'type'))
+
+    unconditional = [rule for rule in rules if not rule['conditional']]
+    literal = [rule for rule in unconditional if rule['kind'] == 'substring']
+    other = [rule for rule in unconditional if rule['kind'] != 'substring']
+
+    combined = []
+    if literal:
+        combined.append(re.compile(_trie_regex(literal)))
+    if other:
+        combined.append(re.compile('|'.join(f"(?P<r{rule['index']}>{rule['pattern']})" for rule in other)))
+
+    return {
+        'rules': rules,
+        'combined': combined,
+        'conditional': [rule for rule in rules if rule['conditional']],
+        'keys': np.array([rule['expense'] for rule in rules]),
+        'lines': np.array([rule['line'] for rule in rules], dtype=np.int32),
+    }
+
+
+def source_digest(file_coa):
+    """SHA-256 of a mappings file, stored in binary rulesets to detect stale ones."""
+    with open(file_coa, 'rb') as file:
+        return hashlib.sha256(file.read()).digest()
+
+
+def save_ruleset(compiled, path, digest=b''):
+    """Write a compiled ruleset in the versioned binary format."""
+    parts = [_HEADER.pack(RULESET_MAGIC, RULESET_VERSION, 0, len(compiled['rules']), digest.ljust(32, b'\0'))]
+    for rule in compiled['rules']:
+        text = rule['text'].encode('utf-8')
+        details = '|'.join(sorted(rule['details'])).encode('utf-8') if rule['details'] else b''
+        type_ = '|'.join(sorted(rule['type'])).encode('utf-8') if rule['type'] else b''
+        flags = (rule['amount_min'] is not None) | (rule['amount_max'] is not None) << 1
+        parts.append(_RECORD.pack(rule['line'], int(rule['expense']), _KINDS.index(rule['kind']), flags,
+                                  rule['amount_min'] or 0, rule['amount_max'] or 0,
+                                  len(text), len(details), len(type_)))
+        parts += [text, details, type_]
+    with open(path, 'wb') as file:
+        file.write(b''.join(parts))
+
+
+def load_ruleset(path):
+    """Read a binary ruleset written by save_ruleset; raises ValueError if it is not one."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"{path} is too short to be a ruleset")
+    magic, version, _, count, digest = _HEADER.unpack_from(data)
+    if magic != RULESET_MAGIC:
+        raise ValueError(f"{path} is not a COA ruleset")
+    if version != RULESET_VERSION:
+        raise ValueError(f"{path} is ruleset version {version}; this Auto-Tax reads version {RULESET_VERSION}. "
+                         f"Recompile it with utility/compile_COA.py")
+
+    rules = []
+    offset = _HEADER.size
+    for _ in range(count):
+        line, expense, kind, flags, amount_min, amount_max, n_text, n_details, n_type = \
+            _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        text, details, type_ = (data[offset:offset + n_text].decode('utf-8'),
+                                data[offset + n_text:offset + n_text + n_details].decode('utf-8'),
+                                data[offset + n_text + n_details:offset + n_text + n_details + n_type].decode('utf-8'))
+        offset += n_text + n_details + n_type
+        rule = make_rule(line, expense, text, details=details, type_=type_)
+        if rule['kind'] != _KINDS[kind]:
+            raise ValueError(f"{path}: rule on line {line} does not match its recorded kind")
+        rule['amount_min'] = amount_min if flags & 1 else None
+        rule['amount_max'] = amount_max if flags & 2 else None
+        rules.append(rule)
+
+    compiled = build_ruleset(rules)
+    compiled['digest'] = digest
+    return compiled
+
+
+def _trie_regex(rules):
+    """Build one regex matching all literal rules, shaped as a prefix trie.
+
+    Each rule ends in an empty named group (?P<rN>). A rule whose text extends an
+    earlier rule's text can never win at the same position, so it is pruned. The
+    remaining ones sit deeper than their prefixes with smaller indexes, and the trie
+    tries deeper branches first, so a match at a position always reports the
+    lowest-numbered rule matching there.
+    """
+    root = {}
+    for rule in rules:
+        node = root
+        for char in rule['text']:
+            node = node.setdefault(char, {})
+        node[None] = min(node.get(None, rule['index']), rule['index'])
+
+    def emit(node, best_above):
+        terminal = node.get(None)
+        if terminal is not None and terminal > best_above:
+            terminal = None
+        best = best_above if terminal is None else terminal
+
+        branches = []
+        for char in sorted(key for key in node if key is not None):
+            branch = emit(node[char], best)
+            if branch is not None:
+                branches.append(re.escape(char) + branch)
+        if terminal is not None:
+            branches.append(f'(?P<r{terminal}>)')
+
+        if not branches:
+            return None
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    return emit(root, float('inf')) or '(?!)'
+
+
+def first_unconditional_match(compiled, description):
+    """Index of the first unconditional rule (file order) matching the description, or -1.
+
+    At every position where something matches, the combined regexes report the
+    lowest-numbered rule matching there; the minimum over those positions is the
+    first rule in file order.
+    """
+    best = -1
+    for combined in compiled['combined']:
+        match = combined.search(description)
+        while match:
+            index = int(match.lastgroup[1:])
+            if best == -1 or index < best:
+                best = index
+            match = combined.search(description, match.start() + 1)
+    return best
+
+
+def conditions_hold(rule, amount=None, details=None, type_=None):
+    """Check a rule's amount/Details/Type conditions for one transaction."""
+    if rule['amount_min'] is not None and (amount is None or pd.isna(amount) or amount < rule['amount_min']):
+        return False
+    if rule['amount_max'] is not None and (amount is None or pd.isna(amount) or amount > rule['amount_max']):
+        return False
+    if rule['details'] is not None and (details is None or pd.isna(details) or str(details).upper() not in rule['details']):
+        return False
+    if rule['type'] is not None and (type_ is None or pd.isna(type_) or str(type_).upper() not in rule['type']):
+        return False
+    return True
+
+
+def rule_matches(rule, description, amount=None, details=None, type_=None):
+    """Evaluate a single rule on its own (the row-by-row reference path)."""
+    return rule['regex'].search(description) is not None and conditions_hold(rule, amount, details, type_)
+
+
+def match_description(compiled, description, amount=None, details=None, type_=None):
+    """Index of the winning rule for one transaction, or -1 if nothing matches."""
+    description = str(description)
+    best = first_unconditional_match(compiled, description)
+    for rule in compiled['conditional']:
+        if best != -1 and rule['index'] > best:
+            break
+        if rule_matches(rule, description, amount, details, type_):
+            return rule['index']
+    return best
+
+
+def encode_descriptions(descriptions):
+    """Dictionary-encode descriptions: (int32 codes, list of unique texts).
+
+    Missing descriptions get their own code and the text 'nan', as str() gives the
+    row-by-row path.
+    """
+    codes, uniques = pd.factorize(descriptions, use_na_sentinel=True)
+    texts = [str(text) for text in uniques]
+    codes = codes.astype(np.int32)
+    if (codes == -1).any():
+        codes[codes == -1] = len(texts)
+        texts.append('nan')
+    return codes, texts
+
+
+def column_in(df, column, choices):
+    """Boolean array: the upper-cased column value is one of choices (False for NA or a missing column)."""
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Test each distinct value once; code -1 (NA) picks the trailing False
+        allowed = np.asarray(values.cat.categories.astype('string').str.upper().isin(choices), dtype=bool)
+        return np.r_[allowed, False][values.cat.codes.to_numpy()]
+    return values.astype('string').str.upper().isin(choices).fillna(False).to_numpy(dtype=bool)
+
+
+def match_rules(compiled, df):
+    """Vectorized rule matching for a transactions DataFrame.
+
+    Descriptions are matched once per unique text and broadcast back to the rows
+    through their codes, so repeated merchants cost one match each.
+    Returns an int32 array with the winning rule index per row (-1 when unmatched).
+    """
+    codes, texts = encode_descriptions(df['Description'])
+    unique_result = np.fromiter((first_unconditional_match(compiled, text) for text in texts),
+                                dtype=np.int32, count=len(texts))
+    result = unique_result[codes]
+    if not compiled['conditional']:
+        return result
+
+    unique_texts = pd.Series(texts, dtype=object)
+    for rule in compiled['conditional']:
+        candidate = (result == -1) | (result > rule['index'])
+        if not candidate.any():
+            continue
+        matches = unique_texts.str.contains(rule['regex'], regex=True).to_numpy(dtype=bool)
+        mask = candidate & matches[codes]
+        amount = df['Amount'] if 'Amount' in df.columns else pd.Series(pd.NA, index=df.index)
+        if rule['amount_min'] is not None:
+            mask &= (amount >= rule['amount_min']).fillna(False).to_numpy(dtype=bool)
+        if rule['amount_max'] is not None:
+            mask &= (amount <= rule['amount_max']).fillna(False).to_numpy(dtype=bool)
+        for column, key in (('Details', 'details'), ('Type', 'type')):
+            if rule[key] is not None:
+                mask &= column_in(df, column, rule[key])
+        result[mask] = rule['index']
+
+    return result
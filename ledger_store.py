@@ -0,0 +1,251 @@
+"""
+================================================================================
+ SQLite Ledger Store
+================================================================================
+ Description:  Embedded SQLite backend for mapped and non-mapped transactions.
+               Every run is stored under its source statement, so questions
+               that span several years are answered from one file instead of
+               reloading and re-mapping old statements.
+
+ Tables:
+ - transactions → one row per statement line (status = mapped / non_mapped).
+ - expenses     → grouped expense totals per source statement.
+ - summaries    → reconciliation totals per source statement (Transaction_Summary.txt
+                  in CSV mode).
+ - rule_hits    → hits and amount per COA rule per source (Rule_Hits.csv in CSV
+                  mode, only with --provenance).
+
+ Notes:
+ - Amounts and balances are stored as INTEGER cents, dates as ISO "YYYY-MM-DD" text.
+ - Saving a source again replaces all of its previous rows (both statuses, in
+   one transaction) instead of duplicating them.
+ - Inserts use executemany inside a single transaction.
+
+================================================================================
+"""
+
+
+import os
+import sqlite3
+import pandas as pd
+
+DEFAULT_LEDGER = os.path.join(os.path.dirname(__file__), 'ledger.sqlite3')
+
+TRANSACTION_COLUMNS = ['Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance', 'Check', 'KEY']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id             INTEGER PRIMARY KEY,
+    source         TEXT NOT NULL,
+    status         TEXT NOT NULL,
+    "Details"      TEXT,
+    "Posting Date" TEXT,
+    "Description"  TEXT,
+    "Amount"       INTEGER,
+    "Type"         TEXT,
+    "Balance"      INTEGER,
+    "Check"        TEXT,
+    "KEY"          INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_key_date
+    ON transactions ("KEY", "Posting Date");
+CREATE INDEX IF NOT EXISTS idx_transactions_description
+    ON transactions ("Description");
+CREATE INDEX IF NOT EXISTS idx_transactions_source
+    ON transactions (source, status);
+
+CREATE TABLE IF NOT EXISTS expenses (
+    source    TEXT NOT NULL,
+    "KEY"     INTEGER,
+    "ACCOUNT" TEXT,
+    "Amount"  INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_source
+    ON expenses (source);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    source       TEXT PRIMARY KEY,
+    "Total"      INTEGER,
+    "Mapped"     INTEGER,
+    "Non_Mapped" INTEGER,
+    "Balanced"   INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS rule_hits (
+    source      TEXT NOT NULL,
+    "RULE_ID"   INTEGER,
+    "RULE_TEXT" TEXT,
+    "EXPENSE"   INTEGER,
+    "HITS"      INTEGER,
+    "Amount"    INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_rule_hits_source
+    ON rule_hits (source);
+"""
+
+# Columns added after the first release, added in place to existing ledgers
+ADDED_COLUMNS = {'transactions': {'Balance': 'INTEGER'}}
+
+
+INSERT_TRANSACTION = (
+    'INSERT INTO transactions (source, status, '
+    + ', '.join(f'"{col}"' for col in TRANSACTION_COLUMNS)
+    + ') VALUES (' + ', '.join('?' * (len(TRANSACTION_COLUMNS) + 2)) + ')'
+)
+
+
+def open_ledger(db_path=DEFAULT_LEDGER):
+    """Open (and create if needed) the ledger database."""
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for column, sql_type in columns.items():
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {sql_type}')
+    return conn
+
+
+def to_iso_dates(values):
+    """Convert statement dates (MM/DD/YYYY or anything pandas parses) to ISO text."""
+    dates = pd.to_datetime(values, format='%m/%d/%Y', errors='coerce')
+    missing = dates.isna() & pd.Series(values).notna().to_numpy()
+    if missing.any():
+        dates[missing] = pd.to_datetime(pd.Series(values)[missing], errors='coerce')
+    return dates.dt.strftime('%Y-%m-%d')
+
+
+def _ledger_rows(df, source, status):
+    """Build plain Python row tuples (no numpy scalars) for executemany."""
+    rows = pd.DataFrame(index=df.index)
+    for col in TRANSACTION_COLUMNS:
+        rows[col] = df[col] if col in df.columns else None
+
+    # Chase exports call the check column 'Check or Slip #'
+    if 'Check or Slip #' in df.columns:
+        rows['Check'] = df['Check or Slip #']
+
+    rows['Posting Date'] = to_iso_dates(rows['Posting Date'])
+    for col in ('Amount', 'Balance'):
+        rows[col] = pd.to_numeric(rows[col], errors='coerce').astype('Int64')
+    rows['KEY'] = pd.to_numeric(rows['KEY'], errors='coerce').astype('Int64')
+    rows['Check'] = rows['Check'].astype('string')
+    rows.insert(0, 'status', status)
+    rows.insert(0, 'source', source)
+
+    rows = rows.astype(object)
+    return rows.where(rows.notna(), None).to_numpy().tolist()
+
+
+def save_transactions_to_ledger(mapped_df, non_mapped_df, source, db_path=DEFAULT_LEDGER):
+    """Replace the mapped and non-mapped rows stored for a source in a single transaction.
+
+    The earlier rows are deleted even when a frame is empty, so a re-run never leaves stale rows behind.
+    """
+    rows = {status: _ledger_rows(df, source, status) if df is not None and not df.empty else []
+            for status, df in (('mapped', mapped_df), ('non_mapped', non_mapped_df))}
+
+    conn = open_ledger(db_path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM transactions WHERE source = ?', (source,))
+            conn.executemany(INSERT_TRANSACTION, rows['mapped'] + rows['non_mapped'])
+    finally:
+        conn.close()
+    print(f"🗄️ Transactions saved to ledger: {len(rows['mapped'])} mapped, "
+          f"{len(rows['non_mapped'])} non-mapped → {db_path} [{source}]")
+
+
+def save_expenses_to_ledger(expense_sum, source, db_path=DEFAULT_LEDGER):
+    """Store grouped expense totals in the ledger, replacing earlier totals for the source."""
+    expenses = expense_sum[expense_sum['Amount'].notna()]
+    rows = pd.DataFrame({
+        'source': source,
+        'KEY': pd.to_numeric(expenses['KEY'], errors='coerce').astype('Int64'),
+        'ACCOUNT': expenses['ACCOUNT'],
+        'Amount': expenses['Amount'].astype('Int64'),
+    }).astype(object)
+    rows = rows.where(rows.notna(), None).to_numpy().tolist()
+
+    conn = open_ledger(db_path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM expenses WHERE source = ?', (source,))
+            conn.executemany('INSERT INTO expenses (source, "KEY", "ACCOUNT", "Amount") VALUES (?, ?, ?, ?)', rows)
+    finally:
+        conn.close()
+    print(f"🗄️ Expenses saved to ledger: {db_path} [{source}]")
+
+
+def save_rule_hits_to_ledger(report, source, db_path=DEFAULT_LEDGER):
+    """Store the per-rule hit report (--provenance) of a source, replacing earlier hits."""
+    rows = pd.DataFrame({
+        'source': source,
+        'RULE_ID': report['RULE_ID'].astype('int64'),
+        'RULE_TEXT': report['RULE_TEXT'].astype(str),
+        'EXPENSE': pd.to_numeric(report['EXPENSE'], errors='coerce').astype('Int64'),
+        'HITS': report['HITS'].astype('int64'),
+        'Amount': report['Amount'].astype('int64'),
+    }).astype(object)
+    rows = rows.where(rows.notna(), None).to_numpy().tolist()
+
+    conn = open_ledger(db_path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM rule_hits WHERE source = ?', (source,))
+            conn.executemany('INSERT INTO rule_hits (source, "RULE_ID", "RULE_TEXT", "EXPENSE", "HITS", "Amount") '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    finally:
+        conn.close()
+    print(f"🗄️ Rule hit report saved to ledger: {db_path} [{source}]")
+
+
+def save_summary_to_ledger(total, mapped, non_mapped, source, db_path=DEFAULT_LEDGER):
+    """Store the reconciliation totals (cents) of a source, replacing earlier ones."""
+    conn = open_ledger(db_path)
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO summaries (source, "Total", "Mapped", "Non_Mapped", "Balanced") '
+                         'VALUES (?, ?, ?, ?, ?)', (source, total, mapped, non_mapped, int(total == mapped + non_mapped)))
+    finally:
+        conn.close()
+    print(f"🗄️ Transaction summary saved to ledger: {db_path} [{source}]")
+
+
+def query_expenses(year=None, db_path=DEFAULT_LEDGER):
+    """Total mapped expenses per KEY (optionally for one year), amounts in cents."""
+    sql = ('SELECT "KEY", COUNT(*) AS "Count", SUM("Amount") AS "Amount" FROM transactions '
+           'WHERE status = \'mapped\'')
+    params = []
+    if year is not None:
+        # Range on the indexed ISO date instead of strftime() so the index is used
+        sql += ' AND "Posting Date" >= ? AND "Posting Date" < ?'
+        params += [f'{int(year):04d}-01-01', f'{int(year) + 1:04d}-01-01']
+    sql += ' GROUP BY "KEY" ORDER BY "KEY"'
+
+    conn = open_ledger(db_path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def query_unmapped_merchants(search=None, db_path=DEFAULT_LEDGER):
+    """List non-mapped descriptions across all stored statements, most frequent first."""
+    sql = ('SELECT "Description", COUNT(*) AS "Count", SUM("Amount") AS "Amount", '
+           'MIN("Posting Date") AS "First Seen", MAX("Posting Date") AS "Last Seen" '
+           'FROM transactions WHERE status = \'non_mapped\'')
+    params = []
+    if search:
+        # Prefix search can use the Description index
+        sql += ' AND "Description" >= ? AND "Description" < ?'
+        params += [search, search + '\U0010ffff']
+    sql += ' GROUP BY "Description" ORDER BY "Count" DESC, "Description"'
+
+    conn = open_ledger(db_path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
@@ -8,8 +8,10 @@
                Chart of Accounts (COA), and generates categorized reports.
                
  Features:
- ✅ Reads transaction data from CSV.
- ✅ Maps transactions based on COA descriptions.
+ ✅ Reads transaction data from CSV (bank format sniffed from the header, see bank_formats.py).
+ ✅ Maps CHECK rows by check number (data/coa/Checks.txt).
+ ✅ Maps transactions based on COA descriptions (substring, ws:, re: rules with
+    optional amount/Details/Type conditions, see coa_rules.py).
  ✅ Assigns account names using a COA Key file.
  ✅ Saves mapped and non-mapped transactions separately.
  ✅ Generates professional HTML previews for review.
@@ -19,25 +21,51 @@
  File Outputs:
  - Mapped_Transactions.csv      → Contains successfully mapped transactions.
  - Non_Mapped_Transactions.csv  → Contains transactions that need COA updates.
+ - Non_Mapped_Clusters.csv      → Non-mapped descriptions grouped by merchant, with a
+                                  proposed COA pattern per cluster.
+ - Rule_Hits.csv                → Hits and amount per COA line, dead rules included
+                                  (--provenance, which also adds RULE_ID / RULE_TEXT
+                                  to Mapped_Transactions.csv).
  - Mapped_Transactions_Preview.html → HTML table preview of mapped transactions.
  - Non_Mapped_Transactions_Preview.html → HTML table preview of non-mapped transactions.
  - Expense.csv                  → Summary of grouped expenses.
+ - Transaction_Summary.txt      → Reconciliation of mapped + non-mapped against the
+                                  statement total.
+ - ledger.sqlite3               → Same results stored per statement (--output sqlite);
+                                  no loose files are written in that mode.
 
  Dependencies:
  - pandas
  - tabulate (for console table formatting)
+ - pyarrow (optional: multithreaded CSV reader, falls back to the pandas C parser)
 
  Notes:
  - Transactions with KEY = 0 are classified as "Non Expense."
  - The COA Key file must contain a mapping for all expected expense categories.
+ - Amounts are carried as int64 cents from load to output so totals are exact;
+   they are only formatted back to dollars when a file is written.
 
 ================================================================================
 """
 
 
+import io
 import os
+import re
+import csv
+import argparse
+import numpy as np
 import pandas as pd
 from tkinter import filedialog, Tk
+from ledger_store import (DEFAULT_LEDGER, save_transactions_to_ledger, save_expenses_to_ledger,
+                          save_rule_hits_to_ledger, save_summary_to_ledger)
+from bank_formats import CANONICAL_COLUMNS, sniff_bank_format, source_columns
+from coa_rules import (RULESET_EXTENSION, compile_coa, load_ruleset, match_rules, rule_matches,
+                       rule_pattern, source_digest)
+
+AMOUNT_COLUMNS = ['Amount', 'Debit', 'Credit', 'Balance']
+CHECK_COLUMNS = ['Check or Slip #', 'Check']
+CHECK_RULE_TEXT = 'Checks.txt'     # RULE_TEXT for rows mapped by check number (RULE_ID -1)
 
 def select_transaction_file():
     """Open a file dialog to allow user to select a transaction file."""
@@ -50,6 +78,218 @@ def select_transaction_file():
     return file_path
 
 
+def parse_cents(values):
+    """Parse a column of dollar amounts into exact integer cents (Int64, NA for blanks).
+
+    Numbers are dollars whatever their dtype (a whole-dollar export reads as int64),
+    so call this on raw export columns only, never on columns already in cents.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype('Int64') * 100
+    if pd.api.types.is_float_dtype(values):
+        return (values.astype('float64') * 100).round().astype('Int64')
+
+    # Fast path: plain "-1234.56" values parse as floats and round back to the exact cents
+    # (doubles are exact to the cent far beyond any ledger); sub-cent values are left over
+    numbers = _to_float(values)
+    scaled = numbers * 100
+    rounded = np.round(scaled)
+    simple = np.abs(scaled - rounded) < 1e-6          # False for NaN as well
+
+    cents = pd.array(np.where(simple, rounded, 0).astype('int64'), dtype='Int64')
+    cents[~simple] = pd.NA
+    cents = pd.Series(cents, index=values.index)
+
+    # Everything else ("1,234.50", "(4.10)", "$5.678") goes through exact string parsing
+    rest = values[~simple & values.notna().to_numpy()]
+    if not rest.empty:
+        cents[rest.index] = _parse_cents_text(rest.astype('string').str.strip())
+    return cents
+
+
+def _to_float(values):
+    """Convert text to float64 (NaN where invalid), natively for Arrow-backed strings."""
+    if isinstance(values.dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        try:
+            # Casting inside Arrow avoids materializing millions of Python strings
+            strings = pc.utf8_trim_whitespace(values.array.__arrow_array__())
+            return pc.cast(strings, pa.float64()).to_numpy(zero_copy_only=False)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass  # Formatted values like "1,234.50"; let pandas coerce them
+    return pd.to_numeric(values, errors='coerce').astype('float64').to_numpy()
+
+
+def _parse_cents_text(text):
+    """Exact string → cents parsing for formatted or sub-cent values."""
+    # A minus or parenthesis anywhere marks a negative: "-$12.00", "$-12.00", "12.00-", "(12.00)"
+    negative = text.str.contains(r'[-(]')
+    text = text.str.replace(r'[^0-9.]', '', regex=True)
+    text = text.mask(text.isin(['', '.']))
+
+    # Anything but one optional decimal point (e.g. "1.2.3") does not match and becomes NA
+    parts = text.str.extract(r'^(\d*)\.?(\d*)$')
+    whole = parts[0].mask(parts[0] == '', '0')
+    fraction = parts[1].str.pad(3, side='right', fillchar='0')
+
+    # Round half up on the third decimal so "5.675" becomes 568 cents
+    cents = (whole.astype('Int64') * 100
+             + fraction.str[:2].astype('Int64')
+             + (fraction.str[2] >= '5').astype('Int64'))
+    cents = cents.where(~negative.fillna(False), -cents)
+    return cents.astype('Int64')
+
+
+def format_cents(cents):
+    """Format a column of integer cents as dollar strings ("-1234.56"); NA becomes ""."""
+    cents = pd.Series(cents).astype('Int64')
+    magnitude = cents.abs()
+    sign = pd.Series(np.where(cents.fillna(0) < 0, '-', ''), index=cents.index)
+    text = (sign + (magnitude // 100).astype('string') + '.'
+            + (magnitude % 100).astype('string').str.zfill(2))
+    return text.fillna('').astype(object)
+
+
+def format_money(cents):
+    """Format a single integer cents value for display ("71,630.12")."""
+    sign = '-' if cents < 0 else ''
+    return f"{sign}{abs(int(cents)) // 100:,}.{abs(int(cents)) % 100:02d}"
+
+
+def format_amounts(df):
+    """Return a copy of the DataFrame with cents columns formatted for output."""
+    df = df.copy()
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = format_cents(df[col])
+    return df
+
+
+def preprocess_amounts(df):
+    """Convert money columns to int64 cents and derive Amount from Debit/Credit if needed."""
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_cents(df[col])
+
+    if 'Debit' in df.columns and 'Credit' in df.columns:
+        df['Amount'] = df['Debit'].fillna(0) - df['Credit'].fillna(0)  # Convert Debits/Credits to Amount
+        print('✅ Preprocessing Complete!')
+
+    if 'Amount' in df.columns:
+        df['Amount'] = df['Amount'].fillna(0).astype('int64')
+    return df
+
+
+def pyarrow_available():
+    """Return True if the optional pyarrow CSV reader can be used."""
+    try:
+        import pyarrow.csv  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def to_category(values):
+    """Dictionary-encode a text column with plain object categories.
+
+    Missing values then read back as NaN whether the column came from the C or the
+    Arrow reader, so both engines produce the same frame.
+    """
+    codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=True)
+    categories = pd.Index(np.asarray(uniques, dtype=object), dtype=object)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index)
+
+
+def normalize_transactions(df, bank_format):
+    """Normalize a loaded export into the canonical typed columns of its bank format.
+
+    Amount and Balance become int64 cents, Check an Int64 check number; all in
+    vectorized column operations. Description, Details and Type are dictionary-encoded
+    (categorical: each distinct text stored once plus integer codes), as statements
+    repeat the same merchants and transaction kinds over and over. Posting Date stays
+    text so it is written back exactly as the bank exported it.
+    """
+    normalized = pd.DataFrame(index=df.index)
+    renames = {canonical: source for source, canonical in bank_format['columns'].items() if canonical}
+
+    for canonical in CANONICAL_COLUMNS:
+        source = renames.get(canonical)
+        normalized[canonical] = df[source] if source in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+
+    amount = bank_format['amount']
+    if isinstance(amount, tuple):
+        debit, credit = amount
+        normalized['Amount'] = parse_cents(df[debit]).fillna(0) - parse_cents(df[credit]).fillna(0)
+    else:
+        normalized['Amount'] = parse_cents(df[amount]).fillna(0)
+    normalized['Amount'] = normalized['Amount'].astype('int64')
+    normalized['Balance'] = parse_cents(normalized['Balance'])
+    normalized['Check'] = pd.to_numeric(normalized['Check'], errors='coerce').astype('Int64')
+    for column in ('Description', 'Details', 'Type'):
+        normalized[column] = to_category(normalized[column])
+
+    return normalized
+
+
+def load_transactions(transaction_file_name, engine='auto'):
+    """Load a statement CSV into the canonical columns of its (sniffed) bank format.
+
+    Only the first few KB are read to identify the format, then only the columns that
+    format needs are parsed, as text, and normalized in one typed pass. Unknown layouts
+    are loaded as-is with their money columns converted to cents. Malformed rows are
+    skipped, as import_data always did.
+
+    engine:
+    - 'pyarrow' → multithreaded Arrow CSV reader, Arrow-backed string columns.
+    - 'c'       → the pandas C parser (object-dtype strings).
+    - 'auto'    → pyarrow when it is installed, otherwise 'c'.
+    """
+    if engine in ('auto', 'pyarrow') and not pyarrow_available():
+        if engine == 'pyarrow':
+            print("⚠️ pyarrow is not installed. Falling back to the pandas C parser.")
+        engine = 'c'
+    elif engine == 'auto':
+        engine = 'pyarrow'
+
+    bank_format, header, has_extra_column = sniff_bank_format(transaction_file_name)
+    columns = source_columns(bank_format) if bank_format else header
+    # The sniffed (stripped) header names are used for both engines, and Chase rows end
+    # with an extra empty field, so it is named and left out
+    column_names = header + ['_extra'] if has_extra_column else header
+
+    if engine == 'pyarrow':
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+
+        table = pa_csv.read_csv(
+            transaction_file_name,
+            read_options=pa_csv.ReadOptions(column_names=column_names, skip_rows=1, use_threads=True),
+            parse_options=pa_csv.ParseOptions(invalid_row_handler=lambda row: 'skip'),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={col: pa.string() for col in columns},
+                include_columns=columns,
+                strings_can_be_null=True,       # Blank cells are null, as NaN from the C engine
+            ),
+        )
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    else:
+        # index_col=False keeps a trailing empty field the header doesn't announce from becoming the index
+        df = pd.read_csv(transaction_file_name, header=0, names=column_names, index_col=False,
+                         on_bad_lines='skip', usecols=columns, dtype={col: str for col in columns})
+
+    if bank_format:
+        df = normalize_transactions(df, bank_format)
+        print(f"✅ {bank_format['label']} statement loaded ({engine} engine): "
+              f"{transaction_file_name} → {len(df)} rows")
+    else:
+        print(f"⚠️ Unrecognized statement layout {header}; loading columns as-is.")
+        df = preprocess_amounts(df)
+        print(f"✅ Transactions loaded ({engine} engine): {transaction_file_name} → {len(df)} rows")
+    return df
+
+
 def initialize_transaction_columns(df):
     """Ensure required columns exist in the DataFrame before processing."""
     required_columns = ['KEY']
@@ -61,10 +301,37 @@ def initialize_transaction_columns(df):
     print(f"✅ Initialized columns: {df.columns.tolist()}")
     return df
 
+def coa_line_numbers(text):
+    """File line on which each COA record starts, skipping blank lines like pd.read_csv does."""
+    reader = csv.reader(io.StringIO(text))
+    lines = []
+    start = 1
+    for row in reader:
+        if row and (len(row) > 1 or row[0].strip()):
+            lines.append(start)
+        start = reader.line_num + 1     # Quoted cells may span several lines
+    return lines[1:]                    # The first record is the header
+
+
 def load_coa(file_coa):
-    """Load the COA mapping file with error handling."""
+    """Load the COA mapping file with error handling.
+
+    The index holds each rule's line number in the file (LINE), so messages and
+    RULE_ID point at the right line even with blank lines or multi-line cells.
+    """
     try:
-        coa_df = pd.read_csv(file_coa, encoding='latin1', thousands=',')
+        if hasattr(file_coa, 'read'):
+            text = file_coa.read()
+        else:
+            with open(file_coa, encoding='latin1', newline='') as file:
+                text = file.read()
+        coa_df = pd.read_csv(io.StringIO(text), thousands=',',
+                             dtype={'DESCRIPTION': str, 'DETAILS': str, 'TYPE': str})
+        lines = coa_line_numbers(text)
+        if len(lines) == len(coa_df):
+            coa_df.index = pd.Index(lines, name='LINE')
+        else:
+            print("⚠️ Could not line up COA rows with file lines; rule numbers are row positions.")
         print(f"✅ COA file loaded successfully: {file_coa}")
         print(f"📊 COA Columns: {coa_df.columns.tolist()}")
         return coa_df
@@ -72,6 +339,27 @@ def load_coa(file_coa):
         print(f"❌ Error loading COA file {file_coa}: {e}")
         return None
 
+def load_compiled_coa(file_coa, file_source=None):
+    """Load the COA rules ready for mapping: a binary ruleset (.rules) or the text mappings file.
+
+    For a ruleset, file_source is the mappings file it was compiled from; a warning is
+    printed when that file has changed since.
+    """
+    if not str(file_coa).endswith(RULESET_EXTENSION):
+        coa_df = load_coa(file_coa)
+        return compile_coa(coa_df) if coa_df is not None else None
+
+    try:
+        compiled = load_ruleset(file_coa)
+    except (OSError, ValueError) as e:
+        print(f"❌ Error loading COA ruleset {file_coa}: {e}")
+        return None
+    print(f"✅ COA ruleset loaded successfully: {file_coa} ({len(compiled['rules'])} rules)")
+    if file_source and os.path.exists(file_source) and source_digest(file_source) != compiled['digest']:
+        print(f"⚠️ {file_source} changed after the ruleset was compiled. "
+              f"Run utility/compile_COA.py to pick up the changes.")
+    return compiled
+
 def load_coa_key(file_coa_key):
     """Load the Chart of Accounts Key file to retrieve account names."""
     try:
@@ -83,22 +371,112 @@ def load_coa_key(file_coa_key):
         print(f"❌ Error loading COA Key file {file_coa_key}: {e}")
         return None
 
-def map_single_transaction(transaction, coa_df):
-    """Map a single transaction to COA based on the description."""
-    for _, coa_row in coa_df.iterrows():
-        if pd.notna(coa_row['DESCRIPTION']) and coa_row['DESCRIPTION'] in str(transaction['Description']):
-            return {'KEY': coa_row['EXPENSE']}
+def load_checks(file_checks):
+    """Load the check number → EXPENSE table, indexed by check number for fast joins."""
+    if not file_checks or not os.path.exists(file_checks):
+        print(f"ℹ️ No check mapping file found: {file_checks}")
+        return None
+    try:
+        checks_df = pd.read_csv(file_checks, encoding='latin1', thousands=',')
+        checks_df['CHECK'] = pd.to_numeric(checks_df['CHECK'], errors='coerce').astype('Int64')
+        checks_df = checks_df.dropna(subset=['CHECK'])
+
+        duplicates = checks_df['CHECK'].duplicated()
+        if duplicates.any():
+            print(f"⚠️ Duplicate check numbers (first mapping wins): {checks_df.loc[duplicates, 'CHECK'].tolist()}")
+            checks_df = checks_df[~duplicates]
+
+        print(f"✅ Check mapping file loaded successfully: {file_checks} ({len(checks_df)} checks)")
+        return checks_df.set_index('CHECK')
+    except Exception as e:
+        print(f"❌ Error loading check mapping file {file_checks}: {e}")
+        return None
+
+def map_checks(df, checks_df):
+    """Look up KEYs for CHECK rows by check number in one vectorized join.
+
+    Returns a Series aligned with df holding the check KEY (NA where no check rule applies)
+    and prints the check numbers that still need a mapping.
+    """
+    check_column = next((col for col in CHECK_COLUMNS if col in df.columns), None)
+    if check_column is None:
+        return pd.Series(pd.NA, index=df.index, dtype='Int64')
+
+    check_numbers = pd.to_numeric(df[check_column], errors='coerce').astype('Int64')
+    is_check = check_numbers.notna()
+    if 'Details' in df.columns:
+        is_check &= df['Details'].eq('CHECK')      # 'Check or Slip #' also holds deposit slips
+
+    if checks_df is None or checks_df.empty:
+        check_keys = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    else:
+        check_keys = check_numbers.where(is_check).map(checks_df['EXPENSE']).astype('Int64')
+
+    unmapped_checks = sorted(check_numbers[is_check & check_keys.isna()].unique().tolist())
+    if unmapped_checks:
+        print(f"⚠️ {len(unmapped_checks)} check numbers have no check mapping: {unmapped_checks}")
+
+    return check_keys
+
+def map_single_transaction(transaction, coa):
+    """Map a single transaction to COA based on the description.
+
+    Rules are tried one by one in file order. This is the row-by-row reference path;
+    map_transactions uses the combined regex by default. RULE_ID is the COA line number
+    of the matching rule (header = line 1), or -1.
+    """
+    compiled = compile_coa(coa) if isinstance(coa, pd.DataFrame) else coa
+    for rule in compiled['rules']:
+        if rule_matches(rule, str(transaction['Description']), transaction.get('Amount'),
+                        transaction.get('Details'), transaction.get('Type')):
+            return {'KEY': rule['expense'], 'RULE_ID': rule['line']}
+
+    return {'KEY': None, 'RULE_ID': -1}  # If no match is found
+
+
+def map_transactions(df, coa, checks_df=None, engine='compiled'):
+    """Map all transactions in the DataFrame using the check table and the COA file.
+
+    CHECK rows whose number is in the check table take that KEY; everything else
+    goes through the COA description rules. coa is the COA DataFrame or a ruleset
+    from compile_coa. engine='compiled' scans each description once with the combined
+    rule regex; engine='reference' is the original row-by-row, rule-by-rule loop.
 
-    return {'KEY': None}  # If no match is found
+    Mapped rows carry RULE_ID (int32): the COA line that matched, -1 for check-table rows.
+    """
+    compiled = compile_coa(coa) if isinstance(coa, pd.DataFrame) else coa
+    check_keys = map_checks(df, checks_df)
+
+    if engine == 'reference':
+        mapped_df, non_mapped_df = _map_transactions_reference(df, compiled, check_keys)
+    else:
+        rule_index = match_rules(compiled, df)
+        rule_keys = pd.Series(compiled['keys'][rule_index], index=df.index).where(rule_index >= 0)
+        keys = check_keys.astype(object).where(check_keys.notna(), rule_keys)
+        is_mapped = keys.notna().to_numpy()
+        rule_ids = np.where((rule_index >= 0) & check_keys.isna().to_numpy(),
+                            compiled['lines'][rule_index], -1).astype(np.int32)
+
+        mapped_df = (df[is_mapped].assign(KEY=keys[is_mapped].astype('int64'), RULE_ID=rule_ids[is_mapped])
+                     .reset_index(drop=True))
+        non_mapped_df = df[~is_mapped].drop(columns='KEY', errors='ignore').reset_index(drop=True)
+
+    print(f"✅ {len(mapped_df)} Transactions Mapped Successfully!")
+    print(f"⚠️ {len(non_mapped_df)} Transactions Missing COA Mapping!")
+
+    return mapped_df, non_mapped_df
 
 
-def map_transactions(df, coa_df):
-    """Map all transactions in the DataFrame using the COA file."""
+def _map_transactions_reference(df, compiled, check_keys):
+    """Row-by-row mapping loop kept as the reference for the compiled engine."""
     mapped_list = []
     non_mapped_list = []
-    
-    for _, transaction in df.iterrows():
-        mapped_data = map_single_transaction(transaction, coa_df)
+
+    for idx, transaction in df.iterrows():
+        if pd.notna(check_keys[idx]):
+            mapped_data = {'KEY': check_keys[idx], 'RULE_ID': -1}
+        else:
+            mapped_data = map_single_transaction(transaction, compiled)
 
         if mapped_data['KEY'] is None:
             # ✅ Convert transaction to dictionary and remove 'KEY'
@@ -107,18 +485,44 @@ def map_transactions(df, coa_df):
             non_mapped_list.append(transaction_dict)
         else:
             transaction['KEY'] = mapped_data['KEY']
-            mapped_list.append(transaction.to_dict())
+            mapped_list.append({**transaction.to_dict(), 'RULE_ID': mapped_data['RULE_ID']})
 
     # ✅ Create DataFrames after 'KEY' is already removed
-    mapped_df = pd.DataFrame(mapped_list)
-    non_mapped_df = pd.DataFrame(non_mapped_list)
+    mapped_df = pd.DataFrame(mapped_list, columns=df.columns.drop('KEY', errors='ignore').tolist() + ['KEY', 'RULE_ID'])
+    non_mapped_df = pd.DataFrame(non_mapped_list, columns=df.columns.drop('KEY', errors='ignore'))
 
-    print(f"✅ {len(mapped_df)} Transactions Mapped Successfully!")
-    print(f"⚠️ {len(non_mapped_df)} Transactions Missing COA Mapping!")
+    # Rows went through Python dicts; restore the input column types
+    dtypes = df.dtypes.drop('KEY', errors='ignore')
+    mapped_df = mapped_df.astype({**dtypes.to_dict(), 'KEY': 'int64', 'RULE_ID': 'int32'})
+    non_mapped_df = non_mapped_df.astype(dtypes.to_dict())
 
     return mapped_df, non_mapped_df
 
 
+def add_rule_text(mapped_df, compiled):
+    """Add RULE_TEXT (the COA DESCRIPTION cell) next to RULE_ID."""
+    texts = pd.Series({rule['line']: rule['text'] for rule in compiled['rules']}, dtype=object)
+    rule_text = mapped_df['RULE_ID'].map(texts).fillna(CHECK_RULE_TEXT)
+    return mapped_df.assign(RULE_TEXT=rule_text)
+
+
+def rule_hit_report(mapped_df, compiled):
+    """Hits and total amount per COA rule, in file order; rules that never matched show 0."""
+    hits = (mapped_df[mapped_df['RULE_ID'] >= 0]
+            .groupby('RULE_ID')['Amount'].agg(HITS='size', Amount='sum'))
+    report = pd.DataFrame({
+        'RULE_ID': compiled['lines'],
+        'RULE_TEXT': [rule['text'] for rule in compiled['rules']],
+        'EXPENSE': compiled['keys'],
+    })
+    report = report.join(hits, on='RULE_ID')
+    report['HITS'] = report['HITS'].fillna(0).astype('int64')
+    report['Amount'] = report['Amount'].fillna(0).astype('int64')
+
+    dead = int((report['HITS'] == 0).sum())
+    print(f"📊 Rule hits: {len(report) - dead} of {len(report)} COA rules matched; {dead} had no hits.")
+    return report
+
 
 def assign_account_names(df, coa_key_df):
     """Assign proper account names to transactions using the Chart of Accounts Key file."""
@@ -140,26 +544,140 @@ def save_to_csv(df, filename, message):
     """Save any DataFrame to CSV with error handling and logging."""
     if not df.empty:
         file_path = os.path.join(os.path.dirname(__file__), filename)
-        df.to_csv(file_path, index=False)
+        format_amounts(df).to_csv(file_path, index=False)
         print(f"📄 {message}: {file_path}")
 
-def process_transaction_mapping(df, file_coa, file_coa_key):
-    """Wrapper function to handle the full transaction mapping process."""
+# Reference tokens that vary between otherwise identical merchant descriptions
+CLUSTER_NOISE_PATTERNS = [
+    r'\*\S*',                                 # "AMZN Mktp US*2K3AB1" order references
+    r'\b(?:PPD|WEB|CCD|TEL)?\s*ID:\s*\S+',     # ACH originator ids
+    r'#\S*',                                  # "#0123" store numbers
+    r'\d+',                                   # Remaining digits: dates, store and card numbers
+]
+
+
+def normalize_cluster_descriptions(descriptions):
+    """Strip digits and reference tokens so variants of one merchant share a cluster key."""
+    text = descriptions.astype('string').fillna('').str.upper()
+    for pattern in CLUSTER_NOISE_PATTERNS:
+        text = text.str.replace(pattern, ' ', regex=True)
+    return text.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def propose_coa_pattern(first, last, key='', members=()):
+    """Propose a rule that matches every description in a cluster, or '' when none is found.
+
+    first and last are the sorted extremes of the cluster, key its normalized text.
+    """
+    # The common prefix of the sorted extremes is the common prefix of the whole cluster
+    prefix = os.path.commonprefix([first, last])
+
+    # Don't end the rule in the middle of a word
+    cut = re.split(r'[*#]', prefix)[0]
+    if cut == prefix and len(prefix) < len(first) and not prefix[-1:].isspace() \
+            and not first[len(prefix)].isspace() and ' ' in prefix.strip():
+        cut = prefix[:prefix.rstrip().rfind(' ')]
+
+    # Stop at the first store number / reference token after the merchant name, keeping the raw spacing
+    words = list(re.finditer(r'\S+', cut))
+    kept = words[:1]
+    for word in words[1:]:
+        if any(ch.isdigit() for ch in word.group()):
+            break
+        kept.append(word)
+    end = kept[-1].end() if kept else 0
+    # A prefix ending inside a word ("U" of "Uber" / "UBER") is no merchant name
+    candidates = []
+    if kept and not first[end:end + 1].isalnum() and not last[end:end + 1].isalnum():
+        candidates.append(cut[kept[0].start():end])
+
+    # Members that start differently share only the normalized key: try its longest word runs
+    key_words = key.split()
+    for size in range(len(key_words), 0, -1):
+        for start in range(len(key_words) - size + 1):
+            run = key_words[start:start + size]
+            if any(ch.isalpha() for ch in ''.join(run)):
+                candidates.append('ws:' + ' '.join(run) if size > 1 else run[0])
+
+    for candidate in candidates:
+        regex = re.compile(rule_pattern(candidate)[1])
+        if all(regex.search(member) for member in (members if len(members) else (first, last))):
+            return candidate
+    return ''
+
+
+def cluster_non_mapped(non_mapped_df):
+    """Group non-mapped transactions into merchant clusters ranked by total amount and count."""
+    columns = ['CLUSTER', 'COUNT', 'Amount', 'SAMPLE_DESCRIPTION', 'PROPOSED_PATTERN']
+    if non_mapped_df is None or non_mapped_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    descriptions = non_mapped_df['Description'].astype(str)
+    # groupby hashes the normalized text, so clustering stays linear in the number of rows
+    clusters = (pd.DataFrame({
+            'normalized': normalize_cluster_descriptions(descriptions),
+            'Description': descriptions,
+            'Amount': non_mapped_df['Amount'] if 'Amount' in non_mapped_df.columns else 0,
+        })
+        .groupby('normalized', sort=False)
+        .agg(COUNT=('Description', 'size'), Amount=('Amount', 'sum'),
+             SAMPLE_DESCRIPTION=('Description', 'first'),
+             first=('Description', 'min'), last=('Description', 'max'), members=('Description', 'unique'))
+        .reset_index())
+
+    clusters['PROPOSED_PATTERN'] = [
+        propose_coa_pattern(first, last, key, members)
+        for first, last, key, members in zip(clusters['first'], clusters['last'], clusters['normalized'],
+                                             clusters['members'])]
+
+    clusters = clusters.assign(magnitude=clusters['Amount'].abs())
+    clusters = clusters.sort_values(['magnitude', 'COUNT'], ascending=False, kind='stable').reset_index(drop=True)
+    clusters['CLUSTER'] = clusters.index + 1
+
+    print(f"✅ {len(non_mapped_df)} non-mapped transactions grouped into {len(clusters)} clusters.")
+    return clusters[columns]
+
+
+def process_transaction_mapping(df, file_coa, file_coa_key, output='csv', source=None, db_path=DEFAULT_LEDGER,
+                                file_checks=None, provenance=False, file_source=None):
+    """Wrapper function to handle the full transaction mapping process.
+
+    output is 'csv' (files next to the script) or 'sqlite' (the ledger store, keyed by source).
+    provenance keeps RULE_ID / RULE_TEXT on the mapped rows and writes Rule_Hits.csv.
+    file_coa may be a binary ruleset from utility/compile_COA.py; file_source is then the
+    mappings file it was compiled from, checked for staleness.
+    """
     df = initialize_transaction_columns(df)
-    coa_df = load_coa(file_coa)
+    compiled = load_compiled_coa(file_coa, file_source)
     coa_key_df = load_coa_key(file_coa_key)
+    checks_df = load_checks(file_checks)
 
-    if coa_df is None:
+    if compiled is None:
         print("❌ COA file could not be loaded. Exiting mapping process.")
         return None, None
 
-    mapped_transactions, non_mapped_transactions = map_transactions(df, coa_df)
+    mapped_transactions, non_mapped_transactions = map_transactions(df, compiled, checks_df)
+
+    if provenance:
+        mapped_transactions = add_rule_text(mapped_transactions, compiled)
+        rule_hits = rule_hit_report(mapped_transactions, compiled)
+        if output == 'sqlite':
+            save_rule_hits_to_ledger(rule_hits, source, db_path)
+        else:
+            save_to_csv(rule_hits, "Rule_Hits.csv", "Rule hit report saved")
+    else:
+        mapped_transactions = mapped_transactions.drop(columns='RULE_ID')
 
     # Assign account names using COA Key file
     mapped_transactions = assign_account_names(mapped_transactions, coa_key_df)
 
-    save_to_csv(mapped_transactions, "Mapped_Transactions.csv", "Mapped transactions saved")
-    save_to_csv(non_mapped_transactions, "Non_Mapped_Transactions.csv", "Non-mapped transactions saved")
+    if output == 'sqlite':
+        save_transactions_to_ledger(mapped_transactions, non_mapped_transactions, source, db_path)
+    else:
+        save_to_csv(mapped_transactions, "Mapped_Transactions.csv", "Mapped transactions saved")
+        save_to_csv(non_mapped_transactions, "Non_Mapped_Transactions.csv", "Non-mapped transactions saved")
+        save_to_csv(cluster_non_mapped(non_mapped_transactions), "Non_Mapped_Clusters.csv",
+                    "Non-mapped clusters saved")
 
     return mapped_transactions, non_mapped_transactions
 
@@ -183,6 +701,9 @@ def group_expenses(df):
     # Merge the grouped data with the COA key based on the KEY column
     merged_expenses = pd.merge(key, grouped, how='outer', on='KEY')
 
+    # Keys without transactions come back as NaN; keep the sums as integer cents
+    merged_expenses['Amount'] = merged_expenses['Amount'].astype('Int64')
+
     print("✅ Successfully grouped and merged expenses!\n")
 
     return merged_expenses
@@ -195,9 +716,44 @@ def save_expenses_to_csv(expense_sum):
     print(save_path)
     
     # Save the DataFrame to the CSV file
-    expense_sum.to_csv(save_path, index=False)
+    format_amounts(expense_sum).to_csv(save_path, index=False)
     print("✅ File saved successfully.")
 
+def reconcile_transactions(df, mapped_df, non_mapped_df, output='csv', source=None, db_path=DEFAULT_LEDGER):
+    """Check that mapped + non-mapped amounts add back up to the statement total.
+
+    The summary goes to Transaction_Summary.txt with the other CSV outputs, or to the
+    ledger's summaries table when output is 'sqlite'.
+    """
+    total = int(df['Amount'].sum()) if 'Amount' in df.columns else 0
+    mapped = int(mapped_df['Amount'].sum()) if 'Amount' in mapped_df.columns else 0
+    non_mapped = int(non_mapped_df['Amount'].sum()) if 'Amount' in non_mapped_df.columns else 0
+    expected = mapped + non_mapped
+
+    summary = (
+        "\n📊 **Transaction Breakdown:**\n\n"
+        f"   🏦 Total Transactions:     {format_money(total)}\n"
+        f"   ✅ Mapped Transactions:    {format_money(mapped)}\n"
+        f"   ❓ Non-Mapped Transactions: {format_money(non_mapped)}\n"
+        "   ----------------------------\n"
+        f"   🔎 Expected Total:         {format_money(expected)}\n\n"
+    )
+    # Integer cents compare exactly, so there is no tolerance to tune
+    if total == expected:
+        summary += "✅✅✅ Everything balances! Your transactions are fully accounted for! ✅✅✅"
+    else:
+        summary += f"❌ Totals differ by {format_money(total - expected)}. Some transactions were lost or duplicated."
+
+    print(summary)
+    if output == 'sqlite':
+        save_summary_to_ledger(total, mapped, non_mapped, source, db_path)
+    else:
+        save_path = os.path.join(os.path.dirname(__file__), "Transaction_Summary.txt")
+        with open(save_path, "w") as file:
+            file.write(summary)
+
+    return total == expected
+
 
 
 
@@ -209,6 +765,7 @@ def save_to_preview(df, filename):
     """Save DataFrame to CSV and display a preview table."""
     
     # Step 1: Save the DataFrame to CSV
+    df = format_amounts(df)
     df.to_csv(filename, index=False)
     print(f"✅ {filename} saved successfully.")
 
@@ -227,7 +784,7 @@ def save_to_html_preview(df, filename):
     """Save DataFrame to HTML and display a preview with styling."""
     
     # Step 1: Save the DataFrame to an HTML file with styling
-    html_table = df.to_html(index=False, classes="table table-striped table-bordered", border=0)
+    html_table = format_amounts(df).to_html(index=False, classes="table table-striped table-bordered", border=0)
     
     # Add some basic styling to the table
     html_content = f"""
@@ -277,8 +834,21 @@ def save_to_html_preview(df, filename):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map transactions to the Chart of Accounts.")
+    parser.add_argument('transaction_file', nargs='?', help="Statement CSV (opens a file dialog if omitted)")
+    parser.add_argument('--output', choices=['csv', 'sqlite'], default='csv',
+                        help="Write loose CSV/HTML files (default) or store results in the SQLite ledger")
+    parser.add_argument('--ledger', default=DEFAULT_LEDGER, help="SQLite ledger path for --output sqlite")
+    parser.add_argument('--engine', choices=['auto', 'pyarrow', 'c'], default='auto',
+                        help="CSV reader engine (auto uses pyarrow when installed)")
+    parser.add_argument('--ruleset', help="Compiled COA ruleset (utility/compile_COA.py) to use instead of "
+                                          "parsing Chart_Of_Accounts_Mappings.txt")
+    parser.add_argument('--provenance', action='store_true',
+                        help="Add RULE_ID / RULE_TEXT to mapped transactions and write Rule_Hits.csv")
+    args = parser.parse_args()
+
     # transaction_file_name = "transactions.csv"  # Replace with `select_transaction_file()` if needed
-    transaction_file_name = select_transaction_file()
+    transaction_file_name = args.transaction_file or select_transaction_file()
     
     if not transaction_file_name:
         print("❌ No file selected. Exiting...")
@@ -286,20 +856,26 @@ if __name__ == "__main__":
 
     file_coa = os.path.join(os.path.dirname(__file__), 'data', 'coa', 'Chart_Of_Accounts_Mappings.txt')
     file_coa_key = os.path.join(os.path.dirname(__file__), 'data', 'coa', 'Chart_Of_Accounts_Key.txt')
+    file_checks = os.path.join(os.path.dirname(__file__), 'data', 'coa', 'Checks.txt')
 
-    df = pd.read_csv(transaction_file_name)
+    # Sniffs the bank format and returns canonical columns with Amount in int64 cents
+    df = load_transactions(transaction_file_name, engine=args.engine)
 
-    if 'Debit' in df.columns and 'Credit' in df.columns:
-        df['Amount'] = df['Debit'].fillna(0) - df['Credit'].fillna(0)  # Convert Debits/Credits to Amount
-        print('✅ Preprocessing Complete!')
+    source = os.path.basename(transaction_file_name)
+    mapped_transactions, non_mapped_transactions = process_transaction_mapping(
+        df, args.ruleset or file_coa, file_coa_key, output=args.output, source=source, db_path=args.ledger,
+        file_checks=file_checks, provenance=args.provenance, file_source=file_coa)
 
-    mapped_transactions, non_mapped_transactions = process_transaction_mapping(df, file_coa, file_coa_key)
+    reconcile_transactions(df, mapped_transactions, non_mapped_transactions, args.output, source, args.ledger)
 
     expense_sum = group_expenses(mapped_transactions)
-    save_expenses_to_csv(expense_sum)
-    save_to_preview(mapped_transactions, 'Mapped_Transactions_Updated.csv')
-    save_to_html_preview(non_mapped_transactions, "Non_Mapped_Transactions_Preview.html")
-    save_to_html_preview(mapped_transactions, 'Mapped_Transactions_Preview.html')
+    if args.output == 'sqlite':
+        save_expenses_to_ledger(expense_sum, source, args.ledger)
+    else:
+        save_expenses_to_csv(expense_sum)
+        save_to_preview(mapped_transactions, 'Mapped_Transactions_Updated.csv')
+        save_to_html_preview(non_mapped_transactions, "Non_Mapped_Transactions_Preview.html")
+        save_to_html_preview(mapped_transactions, 'Mapped_Transactions_Preview.html')
 
 
     print("✅✅✅ Processing Complete! All files are saved. 🚀")
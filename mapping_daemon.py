@@ -0,0 +1,299 @@
+"""
+================================================================================
+ Warm Mapping Daemon
+================================================================================
+ Description:  Long-running local service that keeps the compiled COA ruleset
+               and KEY table in memory, so bookkeeping scripts can categorize
+               descriptions without paying pandas import + COA parsing on every
+               call.
+
+ Transport:
+ - Unix socket (default: auto_tax_mapping.sock next to this file); localhost
+   TCP when Unix sockets are unavailable or --port is given.
+ - NDJSON: one JSON request per line, one JSON response line per request.
+   The connection stays open for any number of requests.
+
+ Requests:
+ - {"description": "COSTCO WHSE #0123", "amount": -120.10, "details": "DEBIT", "type": "DEBIT_CARD"}
+       → {"KEY": 19, "ACCOUNT": "Supplies", "RULE": 12}
+         (amount/details/type are optional; RULE is the COA line number;
+          unmatched → KEY, ACCOUNT and RULE are null)
+ - {"descriptions": ["...", {"description": "...", "amount": -5}]}
+       → {"results": [{...}, {...}]}
+ - {"cmd": "ping"} / {"cmd": "reload"} / {"cmd": "stats"}
+
+ Hot reload:
+ - Chart_Of_Accounts_Mappings.txt and Chart_Of_Accounts_Key.txt are polled
+   for mtime/size changes; a changed COA is recompiled and swapped in whole.
+   If the new file fails to compile the previous ruleset stays active.
+
+ Usage:
+   python mapping_daemon.py serve
+   python mapping_daemon.py query "COSTCO WHSE #0123 HAYWARD CA"
+
+================================================================================
+"""
+
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+from functools import lru_cache
+from map_expense import load_coa, load_coa_key
+from coa_rules import compile_coa, match_description, dollars_to_cents
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FILE_COA = os.path.join(HERE, 'data', 'coa', 'Chart_Of_Accounts_Mappings.txt')
+FILE_COA_KEY = os.path.join(HERE, 'data', 'coa', 'Chart_Of_Accounts_Key.txt')
+DEFAULT_SOCKET = os.path.join(HERE, 'auto_tax_mapping.sock')
+DEFAULT_PORT = 8765
+CACHE_SIZE = 65536
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_state(file_coa=FILE_COA, file_coa_key=FILE_COA_KEY):
+    """Load and compile the COA files into the state served by the daemon (None on failure)."""
+    signature = (file_signature(file_coa), file_signature(file_coa_key))
+    coa_df = load_coa(file_coa)
+    coa_key_df = load_coa_key(file_coa_key)
+    if coa_df is None or coa_key_df is None:
+        return None
+
+    try:
+        compiled = compile_coa(coa_df)
+    except (ValueError, KeyError, re.error) as e:
+        print(f"❌ Error compiling COA file {file_coa}: {e}")
+        return None
+
+    accounts = {int(key): str(account) for key, account in zip(coa_key_df['KEY'], coa_key_df['ACCOUNT'])}
+    rules = compiled['rules']
+
+    @lru_cache(maxsize=CACHE_SIZE)
+    def categorize(description, amount=None, details=None, type_=None):
+        index = match_description(compiled, description, amount, details, type_)
+        if index == -1:
+            return {'KEY': None, 'ACCOUNT': None, 'RULE': None}
+        key = int(rules[index]['expense'])
+        return {'KEY': key, 'ACCOUNT': accounts.get(key), 'RULE': rules[index]['line']}
+
+    print(f"✅ Ruleset compiled: {len(rules)} rules, {len(accounts)} accounts")
+    return {
+        'compiled': compiled,
+        'accounts': accounts,
+        'categorize': categorize,
+        'signature': signature,
+        'loaded_at': time.time(),
+    }
+
+
+def request_cents(amount):
+    """Convert a request's dollar amount to integer cents (None when absent)."""
+    if amount is None:
+        return None
+    try:
+        return dollars_to_cents(amount)
+    except (ValueError, OverflowError):
+        raise ValueError(f"Invalid amount: {amount!r}")
+
+
+def categorize_item(state, item):
+    """Categorize one request item (a description string or a dict)."""
+    if isinstance(item, str):
+        return state['categorize'](item)
+    return state['categorize'](str(item.get('description', '')), request_cents(item.get('amount')),
+                               item.get('details'), item.get('type'))
+
+
+class MappingService:
+    """Holds the active ruleset and swaps in a new one when the COA files change."""
+
+    def __init__(self, file_coa=FILE_COA, file_coa_key=FILE_COA_KEY, poll_interval=1.0):
+        self.file_coa = file_coa
+        self.file_coa_key = file_coa_key
+        self.poll_interval = poll_interval
+        self.state = load_state(file_coa, file_coa_key)
+        if self.state is None:
+            raise RuntimeError("COA ruleset could not be loaded")
+        self.requests = 0
+        self.reloads = 0
+        self._stop = threading.Event()
+
+    def reload(self):
+        """Recompile the COA files; keep the current ruleset if that fails."""
+        state = load_state(self.file_coa, self.file_coa_key)
+        if state is None:
+            print("⚠️ Reload failed, keeping the previous ruleset.")
+            # Remember the broken files so they are not recompiled on every poll
+            self.state = {**self.state, 'signature': (file_signature(self.file_coa), file_signature(self.file_coa_key))}
+            return False
+        self.state = state
+        self.reloads += 1
+        print("🔄 COA ruleset reloaded.")
+        return True
+
+    def watch(self):
+        """Poll the COA files and reload when their mtime or size changes."""
+        while not self._stop.wait(self.poll_interval):
+            signature = (file_signature(self.file_coa), file_signature(self.file_coa_key))
+            if signature != self.state['signature']:
+                self.reload()
+
+    def stop(self):
+        self._stop.set()
+
+    def handle(self, request):
+        """Answer one decoded request."""
+        self.requests += 1
+        state = self.state      # One ruleset for the whole request, even if a reload lands meanwhile
+        cmd = request.get('cmd')
+        if cmd == 'ping':
+            return {'ok': True}
+        if cmd == 'reload':
+            return {'ok': self.reload()}
+        if cmd == 'stats':
+            cache = state['categorize'].cache_info()
+            return {'rules': len(state['compiled']['rules']), 'requests': self.requests, 'reloads': self.reloads,
+                    'cache_hits': cache.hits, 'cache_misses': cache.misses, 'loaded_at': state['loaded_at']}
+        if 'descriptions' in request:
+            return {'results': [categorize_item(state, item) for item in request['descriptions']]}
+        if 'description' in request:
+            return categorize_item(state, request)
+        return {'error': 'expected "description", "descriptions" or "cmd"'}
+
+
+class MappingRequestHandler(socketserver.StreamRequestHandler):
+    """NDJSON over a stream socket: one request line in, one response line out."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.service.handle(json.loads(line))
+            except (ValueError, TypeError, AttributeError) as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    ThreadingUnixServer = None
+
+
+def socket_in_use(socket_path):
+    """True when a daemon is answering on the Unix socket."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def make_server(service, socket_path=DEFAULT_SOCKET, port=None):
+    """Create the socket server: Unix socket when possible, otherwise localhost TCP."""
+    if port is None and ThreadingUnixServer is not None:
+        if os.path.exists(socket_path):
+            if socket_in_use(socket_path):
+                raise RuntimeError(f"A mapping daemon is already listening on {socket_path}")
+            os.remove(socket_path)      # Left over from a run that did not shut down cleanly
+        server = ThreadingUnixServer(socket_path, MappingRequestHandler)
+        address = socket_path
+    else:
+        server = ThreadingTCPServer(('127.0.0.1', DEFAULT_PORT if port is None else port), MappingRequestHandler)
+        address = f"127.0.0.1:{server.server_address[1]}"
+    server.service = service
+    return server, address
+
+
+def serve(socket_path=DEFAULT_SOCKET, port=None, poll_interval=1.0):
+    """Run the daemon until interrupted."""
+    service = MappingService(poll_interval=poll_interval)
+    server, address = make_server(service, socket_path, port)
+    threading.Thread(target=service.watch, daemon=True).start()
+    print(f"🚀 Mapping daemon listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Mapping daemon stopped.")
+    finally:
+        service.stop()
+        server.server_close()
+        if address == socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class MappingClient:
+    """Client for the mapping daemon; keeps one connection open across calls."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, port=None, timeout=5.0):
+        if port is None and hasattr(socket, 'AF_UNIX'):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection(('127.0.0.1', DEFAULT_PORT if port is None else port), timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def request(self, payload):
+        self.sock.sendall(json.dumps(payload).encode('utf-8') + b'\n')
+        return json.loads(self.reader.readline())
+
+    def categorize(self, description, amount=None, details=None, type_=None):
+        """Categorize one description; returns {'KEY', 'ACCOUNT', 'RULE'}."""
+        return self.request({'description': description, 'amount': amount, 'details': details, 'type': type_})
+
+    def categorize_batch(self, descriptions):
+        """Categorize a list of description strings or request dicts in one round trip."""
+        return self.request({'descriptions': list(descriptions)})['results']
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm COA mapping daemon.")
+    parser.add_argument('command', choices=['serve', 'query'])
+    parser.add_argument('descriptions', nargs='*', help="Descriptions to categorize (query)")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument('--port', type=int, help=f"Use localhost TCP instead (e.g. {DEFAULT_PORT})")
+    parser.add_argument('--poll', type=float, default=1.0, help="Seconds between COA change checks")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.port, args.poll)
+    else:
+        client = MappingClient(args.socket, args.port)
+        try:
+            descriptions = args.descriptions or [line.rstrip('\n') for line in sys.stdin if line.strip()]
+            for description, result in zip(descriptions, client.categorize_batch(descriptions)):
+                print(f"{result['KEY'] if result['KEY'] is not None else '-':>4}  "
+                      f"{result['ACCOUNT'] or 'NOT MAPPED':<30}  {description}")
+        finally:
+            client.close()
@@ -0,0 +1,244 @@
+"""
+================================================================================
+ COA Mapping Suggestions
+================================================================================
+ Description:  Proposes EXPENSE keys for Non_Mapped_Transactions.csv so new
+               Chart_Of_Accounts_Mappings.txt entries can be picked from a
+               short ranked list instead of being researched by hand.
+
+ How it works:
+ - Descriptions are normalized (upper case, digit runs → '#', single spaces)
+   and split into character trigrams.
+ - An inverted trigram index is built once over the COA descriptions and,
+   optionally, over historically mapped transactions.
+ - All unique unmapped descriptions are scored in vectorized chunks: the
+   postings of their trigrams are summed (IDF weighted) for just the
+   (description, document) pairs that share a trigram, instead of comparing
+   every unmapped × every known description pair.
+ - COA patterns are scored by containment (how much of the pattern appears in
+   the description), history rows by Dice similarity.
+
+ File Outputs:
+ - Mapping_Suggestions.csv → Description, Count, Amount, RANK, KEY, ACCOUNT,
+                             SCORE, MATCHED (the COA line or history row hit).
+
+================================================================================
+"""
+
+
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+from map_expense import load_coa, load_coa_key, parse_cents, format_amounts
+
+
+def normalize_description(text):
+    """Normalize a description for fuzzy comparison."""
+    text = re.sub(r'\d+', '#', str(text).upper())
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def trigrams(text):
+    """Return the set of character trigrams of a normalized description."""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_suggestion_index(coa_df, history_df=None, max_df=0.25):
+    """Build the trigram index over COA descriptions and historically mapped transactions.
+
+    Trigrams found in more than max_df of the documents carry almost no signal and
+    would make every lookup touch most postings, so they are dropped.
+    """
+    docs = coa_df[coa_df['DESCRIPTION'].notna()]
+    documents = pd.DataFrame({'text': docs['DESCRIPTION'].astype(str), 'key': docs['EXPENSE'], 'is_coa': True})
+
+    if history_df is not None and not history_df.empty:
+        # Rows that differ only in digits or spacing are one document per KEY
+        history = history_df[['Description', 'KEY']].dropna()
+        history = history[~history.assign(Description=history['Description'].map(normalize_description))
+                          .duplicated()]
+        documents = pd.concat([documents, pd.DataFrame({
+            'text': history['Description'].astype(str), 'key': history['KEY'], 'is_coa': False})])
+
+    # Documents are ordered by KEY so each key owns one contiguous slice of doc ids
+    documents['key'] = pd.to_numeric(documents['key'], errors='coerce')
+    documents = documents.dropna(subset=['key']).sort_values('key', kind='stable').reset_index(drop=True)
+    doc_text = documents['text'].tolist()
+    doc_key = documents['key'].to_numpy()
+    key_starts = np.flatnonzero(np.r_[True, doc_key[1:] != doc_key[:-1]]) if len(doc_key) else np.array([], int)
+
+    vocab = {}
+    gram_ids = []
+    doc_ids = []
+    for doc_id, text in enumerate(doc_text):
+        for gram in trigrams(normalize_description(text)):
+            gram_ids.append(vocab.setdefault(gram, len(vocab)))
+            doc_ids.append(doc_id)
+
+    gram_ids = np.asarray(gram_ids, dtype=np.int32)
+    doc_ids = np.asarray(doc_ids, dtype=np.int32)
+    n_docs = len(doc_text)
+
+    # Inverted index in CSR form: postings for trigram g are posting_docs[indptr[g]:indptr[g + 1]]
+    order = np.argsort(gram_ids, kind='stable')
+    posting_docs = doc_ids[order]
+    indptr = np.searchsorted(gram_ids[order], np.arange(len(vocab) + 1))
+
+    doc_freq = np.bincount(gram_ids, minlength=len(vocab))
+    idf = np.log((n_docs + 1) / (doc_freq + 1)) + 1.0
+    if n_docs >= 50:
+        idf[doc_freq > max_df * n_docs] = 0.0
+
+    doc_weight = np.bincount(doc_ids, weights=idf[gram_ids], minlength=n_docs)
+
+    print(f"✅ Suggestion index built: {n_docs} documents, {len(vocab)} trigrams")
+    return {
+        'vocab': vocab,
+        'indptr': indptr,
+        'posting_docs': posting_docs,
+        'idf': idf,
+        'doc_weight': doc_weight,
+        'doc_text': np.asarray(doc_text, dtype=object),
+        'doc_is_coa': documents['is_coa'].to_numpy(dtype=bool),
+        'keys': doc_key[key_starts],
+        'key_starts': key_starts,
+        'doc_key_pos': np.cumsum(np.r_[False, doc_key[1:] != doc_key[:-1]]) if len(doc_key) else np.array([], int),
+    }
+
+
+def suggest_batch(descriptions, index, top_k=3, max_cells=4_000_000, dense_fraction=0.125):
+    """Score a batch of descriptions against the index in vectorized chunks.
+
+    Only the (query, document) pairs that share a trigram are scored, so the work
+    grows with the postings touched rather than with queries × documents. When more
+    than dense_fraction of a chunk's pairs are touched, summing them in a bincount
+    scratch (at most max_cells) is cheaper than sorting them with np.unique.
+    Returns one row per (description, rank): Description, RANK, KEY, SCORE, MATCHED.
+    """
+    vocab = index['vocab']
+    idf = index['idf']
+    indptr = index['indptr']
+    doc_weight = index['doc_weight']
+    doc_key_pos = index['doc_key_pos']
+    n_docs = len(doc_weight)
+    descriptions = list(descriptions)
+    chunk_size = max(1, max_cells // max(n_docs, 1))
+    top_k = min(top_k, len(index['key_starts']))
+    results = []
+
+    for chunk_start in range(0, len(descriptions), chunk_size):
+        chunk = descriptions[chunk_start:chunk_start + chunk_size]
+
+        # (query, trigram) pairs for every trigram the index knows about
+        query_ids = []
+        gram_ids = []
+        for query_id, description in enumerate(chunk):
+            for gram in trigrams(normalize_description(description)):
+                gram_id = vocab.get(gram)
+                if gram_id is not None and idf[gram_id] > 0:
+                    query_ids.append(query_id)
+                    gram_ids.append(gram_id)
+        if not gram_ids or top_k == 0:
+            continue
+        query_ids = np.asarray(query_ids, dtype=np.int64)
+        gram_ids = np.asarray(gram_ids, dtype=np.int64)
+        query_weight = np.bincount(query_ids, weights=idf[gram_ids], minlength=len(chunk))
+
+        # Expand each pair into its postings and sum the weighted overlap per touched (query, doc)
+        lengths = indptr[gram_ids + 1] - indptr[gram_ids]
+        offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        docs = index['posting_docs'][np.repeat(indptr[gram_ids], lengths) + np.arange(lengths.sum()) - offsets]
+        codes = np.repeat(query_ids, lengths) * n_docs + docs
+        weights = np.repeat(idf[gram_ids], lengths)
+        if len(codes) < dense_fraction * len(chunk) * n_docs:
+            pairs, pair_ids = np.unique(codes, return_inverse=True)
+            overlap = np.bincount(pair_ids.ravel(), weights=weights)
+        else:
+            overlap = np.bincount(codes, weights=weights, minlength=len(chunk) * n_docs)
+            pairs = np.flatnonzero(overlap)
+            overlap = overlap[pairs]
+        pair_query, pair_doc = np.divmod(pairs, n_docs)
+
+        scores = np.where(
+            index['doc_is_coa'][pair_doc],
+            overlap / np.maximum(doc_weight[pair_doc], 1e-9),                       # Containment for COA patterns
+            2.0 * overlap / (query_weight[pair_query] + doc_weight[pair_doc]),      # Dice for history rows
+        )
+        np.minimum(scores, 1.0, out=scores)
+
+        # Pairs come out of np.unique sorted by (query, doc), and docs are ordered by KEY, so each
+        # (query, KEY) is a contiguous run: take its best score and the first doc reaching it
+        pair_key = doc_key_pos[pair_doc]
+        run_starts = np.flatnonzero(np.r_[True, (pair_query[1:] != pair_query[:-1]) | (pair_key[1:] != pair_key[:-1])])
+        run_lengths = np.diff(np.r_[run_starts, len(overlap)])
+        run_of_pair = np.repeat(np.arange(len(run_starts)), run_lengths)
+        at_best = np.flatnonzero(scores == np.repeat(np.maximum.reduceat(scores, run_starts), run_lengths))
+        best = at_best[np.r_[True, run_of_pair[at_best][1:] != run_of_pair[at_best][:-1]]]
+
+        # Top_k keys per query: highest score, lowest key on ties
+        best = best[np.lexsort((pair_key[best], -scores[best], pair_query[best]))]
+        query_of_best = pair_query[best]
+        group_starts = np.flatnonzero(np.r_[True, query_of_best[1:] != query_of_best[:-1]])
+        ranks = np.arange(len(best)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(best)]))
+        keep = ranks < top_k
+
+        for pair, rank in zip(best[keep], ranks[keep] + 1):
+            results.append((chunk[pair_query[pair]], int(rank), index['keys'][pair_key[pair]],
+                            round(float(scores[pair]), 4), index['doc_text'][pair_doc[pair]]))
+
+    return pd.DataFrame(results, columns=['Description', 'RANK', 'KEY', 'SCORE', 'MATCHED'])
+
+
+def suggest_mappings(non_mapped_df, index, coa_key_df=None, top_k=3):
+    """Suggest COA keys for every unique non-mapped description in one batched pass."""
+    if non_mapped_df is None or non_mapped_df.empty:
+        print("✅ No non-mapped transactions to suggest mappings for.")
+        return pd.DataFrame()
+
+    grouped = (non_mapped_df.assign(Amount=parse_cents(non_mapped_df['Amount']).fillna(0))
+               .groupby('Description', sort=False, observed=True)
+               .agg(Count=('Amount', 'size'), Amount=('Amount', 'sum'))
+               .reset_index())
+
+    # Variants that differ only in digits normalize to the same text, so score each once
+    grouped['normalized'] = grouped['Description'].map(normalize_description)
+    scored = suggest_batch(grouped['normalized'].unique(), index, top_k)
+    scored = scored.rename(columns={'Description': 'normalized'})
+
+    suggestions = grouped.merge(scored, on='normalized', how='inner').drop(columns='normalized')
+    suggestions['KEY'] = pd.to_numeric(suggestions['KEY']).astype('Int64')
+
+    if coa_key_df is not None:
+        accounts = coa_key_df[['KEY', 'ACCOUNT']].assign(KEY=pd.to_numeric(coa_key_df['KEY']).astype('Int64'))
+        suggestions = suggestions.merge(accounts, on='KEY', how='left')
+        suggestions.insert(5, 'ACCOUNT', suggestions.pop('ACCOUNT'))
+
+    suggestions = suggestions.sort_values(['Count', 'Description', 'RANK'], ascending=[False, True, True])
+    print(f"✅ Suggested keys for {grouped.shape[0]} unique non-mapped descriptions.")
+    return suggestions.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Suggest COA keys for non-mapped transactions.")
+    parser.add_argument('--non-mapped', default=os.path.join(here, 'Non_Mapped_Transactions.csv'))
+    parser.add_argument('--history', default=os.path.join(here, 'Mapped_Transactions.csv'),
+                        help="Previously mapped transactions to learn from (skipped if missing)")
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    file_coa = os.path.join(here, 'data', 'coa', 'Chart_Of_Accounts_Mappings.txt')
+    file_coa_key = os.path.join(here, 'data', 'coa', 'Chart_Of_Accounts_Key.txt')
+
+    non_mapped = pd.read_csv(args.non_mapped, dtype={'Amount': str})
+    history = pd.read_csv(args.history, dtype={'Amount': str}) if os.path.exists(args.history) else None
+
+    index = build_suggestion_index(load_coa(file_coa), history)
+    suggestions = suggest_mappings(non_mapped, index, load_coa_key(file_coa_key), args.top_k)
+
+    save_path = os.path.join(here, 'Mapping_Suggestions.csv')
+    format_amounts(suggestions).to_csv(save_path, index=False)
+    print(f"📄 Mapping suggestions saved: {save_path}")
@@ -7,36 +7,69 @@
 from pathlib import Path
 
 import os
+import sys
+import time
+import queue
+import threading
 import tkinter.messagebox
 from tkinter import *
 from tkinter import filedialog
+from tkinter import ttk
 import pandas as pd         # pip install pandas
 import csv
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from map_expense import load_transactions, format_amounts, format_cents
+from coa_rules import compile_coa, match_rules
+
 root = Tk()
 menu = Menu( root )
 root.config(menu=menu)
 label_help = None
 button_close_help = None
 app_width = 700
-app_height = 150
+app_height = 420
+POLL_MS = 100                   # How often the Tk loop drains the worker queue
+CHUNK_SIZE = 2000               # Transactions mapped per progress update
+
+# The one background task allowed at a time; the Tk loop talks to it only through 'events'
+worker = {'thread': None, 'events': None, 'cancel': None, 'on_done': None, 'total': 0, 'started': 0.0}
+
 
 
+def report(events, kind, payload=None):
+    # Send progress to the GUI when running as a background task
+    if events is not None:
+        events.put((kind, payload))
 
-def search_multiple_mappings(file_coa):
+
+def search_multiple_mappings(file_coa, events=None, cancel=None):
     coa = pd.read_csv(file_coa, encoding='latin1', thousands=',')
-    match = False
-    for i, row in coa.iterrows():
-        for j, row in coa.iloc[i+1:].iterrows():
-            if coa.loc[i, 'DESCRIPTION'] in coa.loc[j, 'DESCRIPTION']:
-                match = True
-                print(i+2, coa.loc[i, 'DESCRIPTION'], j+2, coa.loc[j, 'DESCRIPTION'] )     # Add 1 for headings + 1 for index to id
-    if match:
-        print('Fail ! Multiple mappings found.')
-        tkinter.messagebox.showinfo('Fail !', 'Fail ! Multiple mappings found.')
-
-    if not match:
-        print('Success !  No multiple matches.')
+    descriptions = coa['DESCRIPTION'].astype(str).tolist()
+    report(events, 'start', len(descriptions))
+    matches = []
+    for i, first in enumerate(descriptions):
+        if cancel is not None and cancel.is_set():
+            report(events, 'cancelled')
+            return None
+        for j in range(i + 1, len(descriptions)):
+            if first in descriptions[j]:
+                line = f'{i + 2}  {first}  →  {j + 2}  {descriptions[j]}'     # Add 1 for headings + 1 for index to id
+                matches.append(line)
+                if events is None:
+                    print(line)
+                report(events, 'row', line)
+        report(events, 'progress', i + 1)
+
+    if events is None:
+        print('Fail ! Multiple mappings found.' if matches else 'Success !  No multiple matches.')
+    return matches
+
+
+def show_multiple_mappings(matches):
+    if matches:
+        tkinter.messagebox.showinfo('Fail !', f'Fail ! {len(matches)} multiple mappings found.')
+    else:
         tkinter.messagebox.showinfo(title='Success !', message='No multiple matches.')
 
 
@@ -96,101 +129,170 @@ def get_checks():
 #     return mia, chase
 
 
-def map(file_coa, transaction_file_name):
-    print('63')
-    # Load the CSV with the appropriate column headers
-    chase = pd.read_csv(transaction_file_name, skiprows=1)
-    print('64')
-    
-    # Display columns (for debugging purposes)
-    print(chase.columns.values)
-    
-    # Define the column names
-    cnames = ["Details", "Posting Date", "Description", "Amount", "Type", "Balance", "Check", "KEY"]
-    print('67')
-    
-    # Assign the new column names
-    chase.columns = cnames
-    
-    # Fill missing KEY values with 0
-    chase['KEY'] = chase['KEY'].fillna(0)
-    
-    # Read the chart of accounts (COA) file
+def map(file_coa, transaction_file_name, events=None, cancel=None):
+    # The bank format is sniffed from the header and normalized to the canonical columns
+    # (Details, Posting Date, Description, Amount, Type, Balance, Check) with Amount in cents
+    chase = load_transactions(transaction_file_name)
+    chase['KEY'] = 0
+
+    # Compile the chart of accounts (COA) once; the first matching COA line wins
     coa = pd.read_csv(file_coa, encoding='latin1', thousands=',')
-    
-    # No checks are needed, so we can skip that part
-    checks = {}
+    compiled = compile_coa(coa)
 
     mia = 0  # Variable to track how many rows don't match anything in the COA
-    
-    # Iterate through each row in the 'chase' DataFrame
-    for i, row in chase.iterrows():
-        match = False  # Flag to check if a match is found in the COA
-        
+    report(events, 'start', len(chase))
+
+    # Map in chunks so the GUI can show progress and cancel between them
+    for start in range(0, len(chase), CHUNK_SIZE):
+        if cancel is not None and cancel.is_set():
+            report(events, 'cancelled')
+            return None
+        chunk = chase.iloc[start:start + CHUNK_SIZE]
+        rule_index = match_rules(compiled, chunk)
+
         # We skip the check processing, no need to handle 'CHECK' details
-        if chase.loc[i, 'Details'] != 'CHECK':  # No need for the check logic
-            # Loop through COA to find a match
-            for j, coa_row in coa.iterrows():
-                if coa.loc[j, 'DESCRIPTION'] in chase.loc[i, 'Description']:
-                    match = True
-                    chase.loc[i, 'KEY'] = coa.loc[j, 'EXPENSE']
-                    # print(i, chase.loc[i, 'KEY'], chase.loc[i, 'Description'], chase.loc[i, 'Amount'])
-            
-            # If no match found, increment mia
-            if not match:
-                mia += 1
-                print(i, chase.loc[i, 'KEY'], chase.loc[i, 'Description'], chase.loc[i, 'Amount'])
+        not_check = (chunk['Details'] != 'CHECK').to_numpy()
+        matched = not_check & (rule_index >= 0)
+        chase.loc[chunk.index[matched], 'KEY'] = compiled['keys'][rule_index[matched]]
+
+        missing = chunk[not_check & (rule_index < 0)]
+        for i, description, amount in zip(missing.index, missing['Description'], format_cents(missing['Amount'])):
+            mia += 1
+            line = f'{i}  {description}  {amount}'
+            if events is None:
+                print(line)
+            report(events, 'row', line)
+        report(events, 'progress', start + len(chunk))
 
     print(f'MIA = {mia}')
-    
+
     # Return the result
     return mia, chase
 
 
-
 def list_checks(transaction_file_name):
     print('list_checks ')
-    chase = pd.read_csv( transaction_file_name, dtype={7: object}, skiprows = 1 )
-    chase.columns.values
-    cnames = ["Details","Posting Date","Description","Amount","Type","Balance","Check","KEY"]
-    chase.columns = cnames
-    chase['KEY'] = chase['KEY'].fillna(0)
-    checks = []
-    for i, row in chase.iterrows():
-        if chase.loc[i, 'Details'] == 'CHECK':
-            v = list( chase.iloc[i] )
-            checks.append(int( v[6] ))
-    checks_sorted = sorted(checks)
-    for i in checks_sorted:
+    chase = load_transactions(transaction_file_name)
+    checks = chase.loc[chase['Details'] == 'CHECK', 'Check'].dropna()
+    for i in sorted(checks.astype(int)):
         print(i)
 
 
-def group_expenses(mapped_transactions):
+def expense_totals(mapped_transactions, key):
     x = mapped_transactions.groupby(['KEY'])[['Amount']]
     y = x.sum()
-    key = pd.read_csv( 'Chart_Of_Accounts_Key.txt', encoding='latin1', thousands=',')
     e = pd.merge( key, y, how = 'outer', on = 'KEY')
+    e['Amount'] = e['Amount'].astype('Int64')      # The outer merge leaves float NaN; sums stay as exact integer cents
     e['Amount'] = e['Amount'] * -1
-    column_names = ["KEY", "ACCOUNT", "Amount"]
-    expense_sum = e.query('Amount > 0')
+    return e.query('Amount > 0')
+
+
+def group_expenses(mapped_transactions):
+    key = pd.read_csv( 'Chart_Of_Accounts_Key.txt', encoding='latin1', thousands=',')
+    expense_sum = expense_totals(mapped_transactions, key)
     # print( expense_sum )
     name = os.path.join(user_path_field.get(), "Expense.csv")
     print ( "Your tax file is saved to the following location:")
     #expense_sum.reset_index()
     print ( name )
-    expense_sum.to_csv(name)
+    format_amounts(expense_sum).to_csv(name)
     root.destroy()
 
 
 def join(file_coa):
     transaction_file_name = label_transaction_file['text']
     print(f'[{transaction_file_name}]')
-    mia, mapped_transactions = map(file_coa, transaction_file_name)
+    run_in_background('Auto Tax', map, (file_coa, transaction_file_name), finish_join)
+
+
+def finish_join(result):
+    mia, mapped_transactions = result
     if mia:
         tkinter.messagebox.showinfo('Warning', f'There are {mia} transactions MIA.')
     group_expenses(mapped_transactions)
 
 
+def identify_mia(file_coa, transaction_file_name):
+    run_in_background('Identify Transactions MIA', map, (file_coa, transaction_file_name),
+                      lambda result: tkinter.messagebox.showinfo('MIA', f'MIA = {result[0]}'))
+
+
+def identify_duplicates(file_coa):
+    run_in_background('Identify Duplicate Mappings', search_multiple_mappings, (file_coa,), show_multiple_mappings)
+
+
+def run_in_background(title, task, args, on_done):
+    # Run task(*args, events=, cancel=) on a worker thread; on_done(result) runs back on the Tk thread
+    if worker['thread'] is not None and worker['thread'].is_alive():
+        tkinter.messagebox.showinfo('Busy', 'Please wait for the current task or cancel it.')
+        return
+
+    events = queue.Queue()
+    cancel = threading.Event()
+
+    def run():
+        try:
+            events.put(('done', task(*args, events=events, cancel=cancel)))
+        except Exception as e:
+            events.put(('error', e))
+
+    worker.update(events=events, cancel=cancel, on_done=on_done, total=0, started=time.perf_counter())
+    listbox_results.delete(0, END)
+    progress_bar['value'] = 0
+    label_status['text'] = f'{title} ...'
+    button_cancel['state'] = NORMAL
+    worker['thread'] = threading.Thread(target=run, daemon=True)
+    worker['thread'].start()
+    root.after(POLL_MS, poll_worker)
+
+
+def poll_worker():
+    # Drain everything the worker has queued since the last poll, then reschedule
+    while True:
+        try:
+            kind, payload = worker['events'].get_nowait()
+        except queue.Empty:
+            break
+        if kind == 'start':
+            worker['total'] = payload
+            worker['started'] = time.perf_counter()
+            progress_bar['maximum'] = max(payload, 1)
+        elif kind == 'progress':
+            show_progress(payload)
+        elif kind == 'row':
+            listbox_results.insert(END, payload)
+            listbox_results.see(END)
+        elif kind == 'cancelled':
+            label_status['text'] = f'Cancelled.  {listbox_results.size()} rows found before stopping.'
+        elif kind == 'error':
+            button_cancel['state'] = DISABLED
+            label_status['text'] = f'Error: {payload}'
+            tkinter.messagebox.showerror('Error', str(payload))
+            return
+        elif kind == 'done':
+            button_cancel['state'] = DISABLED
+            if payload is not None:
+                worker['on_done'](payload)
+            return
+    root.after(POLL_MS, poll_worker)
+
+
+def show_progress(done):
+    total = worker['total']
+    elapsed = max(time.perf_counter() - worker['started'], 1e-6)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate > 0 else 0
+    progress_bar['value'] = done
+    label_status['text'] = (f'{done:,} / {total:,}   {rate:,.0f}/sec   '
+                            f'ETA {int(eta // 60)}:{int(eta % 60):02d}   {listbox_results.size()} found')
+
+
+def cancel_task():
+    if worker['cancel'] is not None:
+        worker['cancel'].set()
+        label_status['text'] = 'Cancelling ...'
+
+
 def about_us():
     tkinter.messagebox.showinfo('About Sam\'s Tax Assistant', 'This indexes the Chart Of Account reference to your expenses.  Developed by Sam Portillo - 510.246.5504')
 
@@ -251,8 +353,8 @@ exit_menu.add_command(label="Exit", command=root.destroy)
 
 validate_menu = Menu(menu)
 menu.add_cascade(label="Validate", menu=validate_menu)
-validate_menu.add_command(label="Identify Duplicate Mappings", command = lambda: search_multiple_mappings(file_coa))
-validate_menu.add_command(label="Identify Transactions MIA", command = lambda: map(file_coa, f) )
+validate_menu.add_command(label="Identify Duplicate Mappings", command = lambda: identify_duplicates(file_coa))
+validate_menu.add_command(label="Identify Transactions MIA", command = lambda: identify_mia(file_coa, f) )
 
 tax_menu = Menu(menu, tearoff=0)
 menu.add_cascade(label="Tax", menu=tax_menu)
@@ -282,13 +384,32 @@ user_path_field.set('?')
 entry_path.grid(row=row, column=1)
 
 row = 2
-button2 = Button(root, text = "Identity Duplicate Mappings", bg='blue', command = lambda: search_multiple_mappings(file_coa)  ).grid(row=row, column=0)
+button2 = Button(root, text = "Identity Duplicate Mappings", bg='blue', command = lambda: identify_duplicates(file_coa)  ).grid(row=row, column=0)
 
 row = 3
-button3 = Button(root, text = "Identity Transactions MIA", bg='RED', command = lambda: map(file_coa, f) ).grid(row=row, column=0, sticky=W)
+button3 = Button(root, text = "Identity Transactions MIA", bg='RED', command = lambda: identify_mia(file_coa, f) ).grid(row=row, column=0, sticky=W)
 
 row = 4
 button4 = Button(root, text = "List Checks", command = lambda: list_checks(transaction_file_name)  ).grid(row=row, column=0)
 
 row = 5
+progress_bar = ttk.Progressbar(root, orient=HORIZONTAL, length=400, mode='determinate')
+progress_bar.grid(row=row, column=0, columnspan=2, sticky=W, pady=4)
+button_cancel = Button(root, text = "Cancel", state=DISABLED, command = cancel_task)
+button_cancel.grid(row=row, column=2, sticky=W)
+
+row = 6
+label_status = Label(root, text='', justify=LEFT)
+label_status.grid(row=row, column=0, columnspan=3, sticky=W)
+
+row = 7
+frame_results = Frame(root)
+frame_results.grid(row=row, column=0, columnspan=3, sticky=W)
+listbox_results = Listbox(frame_results, width=95, height=12)
+scrollbar_results = Scrollbar(frame_results, orient=VERTICAL, command=listbox_results.yview)
+listbox_results.config(yscrollcommand=scrollbar_results.set)
+listbox_results.pack(side=LEFT)
+scrollbar_results.pack(side=RIGHT, fill=Y)
+
+row = 8
 root.mainloop()
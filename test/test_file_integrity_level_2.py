@@ -1,5 +1,10 @@
+import os
+import sys
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bank_formats import BANK_FORMATS, identify_bank_format
+
 def verify_csv_integrity(file_path):
     # Try to load the file to check for syntax or formatting errors
     try:
@@ -19,27 +24,35 @@ def verify_csv_integrity(file_path):
             print(f"Problematic Row: {row[1].tolist()}")
             return False
 
-    # Verify header integrity (if headers are as expected)
-    expected_columns = ['Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance', 'Check or Slip #']
-    if list(df.columns) != expected_columns:
+    # Verify header integrity: the header must match one of the registered bank formats
+    bank_format = identify_bank_format(df.columns)
+    if bank_format is None:
         print(f"Error: Header mismatch")
-        print(f"Expected header: {expected_columns}")
+        print(f"Expected one of: {[list(f['columns']) for f in BANK_FORMATS]}")
         print(f"Actual header: {df.columns.tolist()}")
         return False
+    print(f"Bank format: {bank_format['label']}")
 
     # Check if required columns have valid data types (e.g., Amount should be numeric)
-    invalid_amount_rows = df[~df['Amount'].apply(pd.to_numeric, errors='coerce').notna()]
-    if not invalid_amount_rows.empty:
-        print("Error: 'Amount' column contains invalid data")
-        for idx, row in invalid_amount_rows.iterrows():
-            # Ensure idx is treated as an integer and converted to string for concatenation
-            print(f"Error at Line {idx }: Invalid 'Amount' value")
-            print(f"Problematic Row: {row.tolist()}")
-            print(f"Invalid 'Amount' Value: {row['Amount']}")
-        return False
+    amount = bank_format['amount']
+    amount_columns = list(amount) if isinstance(amount, tuple) else [amount]
+    for amount_column in amount_columns:
+        values = df[amount_column]
+        if isinstance(amount, tuple):
+            values = values.dropna()    # Debit/Credit exports leave one of the two empty
+        invalid_amount_rows = df.loc[values.index][~values.apply(pd.to_numeric, errors='coerce').notna()]
+        if not invalid_amount_rows.empty:
+            print(f"Error: '{amount_column}' column contains invalid data")
+            for idx, row in invalid_amount_rows.iterrows():
+                # Ensure idx is treated as an integer and converted to string for concatenation
+                print(f"Error at Line {idx }: Invalid '{amount_column}' value")
+                print(f"Problematic Row: {row.tolist()}")
+                print(f"Invalid '{amount_column}' Value: {row[amount_column]}")
+            return False
 
     # Check for empty rows or missing values in important columns (Amount, Description, Posting Date)
-    missing_values = df[['Amount', 'Description', 'Posting Date']].isnull()
+    date_column = next(source for source, canonical in bank_format['columns'].items() if canonical == 'Posting Date')
+    missing_values = df[['Description', date_column] + ([] if isinstance(amount, tuple) else [amount])].isnull()
     if missing_values.any().any():
         print("Error: Missing values in important columns")
         for idx, row in missing_values[missing_values.any(axis=1)].iterrows():
@@ -0,0 +1,430 @@
+"""
+Differential test: every mapping engine must produce exactly the same
+Mapped_Transactions.csv (including the RULE_ID of the matching COA line),
+Non_Mapped_Transactions.csv and Expense.csv as the row-by-row reference mapper.
+
+- test/golden/ holds a synthetic statement, COA and check table, plus the
+  reference outputs. Every engine is compared against those files.
+- Randomly generated COAs and descriptions (seeded, so failures reproduce) embed,
+  overlap, nearly match and re-space the COA patterns. The engines run side by side
+  on them, and the first diverging row is reported.
+- For plain-substring COAs (no ws:/re: rules, no conditions) the engines are also
+  checked against a literal oracle of the original mapper: `rule in description`,
+  first rule in file order wins. It shares no matching code with coa_rules.
+- The 'pruned' engine maps with the ruleset left after
+  utility/compile_COA.remove_dead_rules, which must not change any result.
+
+Run with pytest, or directly:
+    python test/test_mapping_differential.py               # all checks
+    python test/test_mapping_differential.py --benchmark   # smoke benchmark (rows/sec per engine)
+    python test/test_mapping_differential.py --regenerate  # rebuild test/golden (review the diff!)
+"""
+
+import io
+import os
+import re
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_expense import (load_transactions, initialize_transaction_columns, load_coa, load_coa_key, load_checks,
+                         map_checks, map_transactions, assign_account_names, group_expenses, format_amounts,
+                         pyarrow_available)
+from coa_rules import CONDITION_COLUMNS, compile_coa, build_ruleset, save_ruleset, load_ruleset
+from utility.compile_COA import remove_dead_rules
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+GOLDEN_STATEMENT = os.path.join(GOLDEN_DIR, 'statement.csv')
+GOLDEN_COA = os.path.join(GOLDEN_DIR, 'Chart_Of_Accounts_Mappings.txt')
+GOLDEN_CHECKS = os.path.join(GOLDEN_DIR, 'Checks.txt')
+FILE_COA_KEY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'coa',
+                            'Chart_Of_Accounts_Key.txt')
+OUTPUTS = ['Mapped_Transactions.csv', 'Non_Mapped_Transactions.csv', 'Expense.csv']
+
+KEYS = [0, 1, 3, 5, 7, 12, 19, 23, 25, 31, 50, 57]
+WORDS = ['COSTCO', 'WHSE', 'GAS', 'AMZN', 'MKTP', 'US', 'CHEVRON', 'SHELL', 'OIL', 'HOME', 'DEPOT', 'PG&E',
+         'ZELLE', 'PAYMENT', 'TO', 'FROM', 'ATM', 'CHECK', 'DEPOSIT', 'TRACY', 'HAYWARD', 'CA', 'ORIG', 'CO',
+         'NAME:', 'WEB', 'ID:', 'SAFEWAY', 'FUEL', 'STORE', 'ONLINE', 'TRANSFER']
+DETAILS = ['DEBIT', 'DEBIT', 'CREDIT', 'DSLIP']
+TYPES = ['DEBIT_CARD', 'ACH_DEBIT', 'ACH_CREDIT', 'ATM', 'MISC_CREDIT', 'QUICKPAY_DEBIT']
+
+
+# ---------------------------------------------------------------------------
+# Engines and outputs
+# ---------------------------------------------------------------------------
+
+def ruleset_round_trip(coa_df):
+    """The compiled engine fed from a binary ruleset written and read back."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'coa.rules')
+        save_ruleset(compile_coa(coa_df), path)
+        return load_ruleset(path)
+
+
+def pruned_ruleset(coa_df):
+    """The compiled engine after compile_COA drops duplicate and shadowed rules."""
+    kept, _ = remove_dead_rules(compile_coa(coa_df)['rules'])
+    return build_ruleset(kept)
+
+
+def is_plain_coa(coa_df):
+    """True when every rule is a plain substring without conditions, as in the original COA format."""
+    descriptions = coa_df['DESCRIPTION'].dropna().astype(str)
+    conditions = [col for col in CONDITION_COLUMNS if col in coa_df.columns]
+    return (not descriptions.str.startswith(('ws:', 're:')).any()
+            and not coa_df[conditions].replace('', np.nan).notna().any().any())
+
+
+def map_literal_oracle(df, coa_df, checks_df):
+    """The original mapper, written out literally: the first COA row (file order) whose
+    DESCRIPTION is in the description wins. Only valid for plain-substring COAs."""
+    check_keys = map_checks(df, checks_df)
+    rules = [(line, expense, description)
+             for line, expense, description in zip(coa_df.index, coa_df['EXPENSE'], coa_df['DESCRIPTION'])
+             if pd.notna(description)]
+
+    keys = []
+    rule_ids = []
+    for check_key, description in zip(check_keys, df['Description']):
+        if pd.notna(check_key):
+            keys.append(check_key)
+            rule_ids.append(-1)
+            continue
+        match = next(((line, expense) for line, expense, text in rules if text in str(description)), (-1, None))
+        rule_ids.append(match[0])
+        keys.append(match[1])
+
+    keys = pd.Series(keys, index=df.index, dtype=object)
+    is_mapped = keys.notna().to_numpy()
+    mapped_df = (df[is_mapped].assign(KEY=keys[is_mapped].astype('int64'),
+                                      RULE_ID=np.asarray(rule_ids, dtype=np.int32)[is_mapped])
+                 .reset_index(drop=True))
+    non_mapped_df = df[~is_mapped].drop(columns='KEY', errors='ignore').reset_index(drop=True)
+    return mapped_df, non_mapped_df
+
+
+ENGINES = {
+    'reference': lambda df, coa_df, checks_df: map_transactions(df, coa_df, checks_df, engine='reference'),
+    'compiled': lambda df, coa_df, checks_df: map_transactions(df, compile_coa(coa_df), checks_df),
+    'ruleset': lambda df, coa_df, checks_df: map_transactions(df, ruleset_round_trip(coa_df), checks_df),
+    'pruned': lambda df, coa_df, checks_df: map_transactions(df, pruned_ruleset(coa_df), checks_df),
+    'oracle': map_literal_oracle,
+}
+
+
+def engines_for(coa_df):
+    """Engines that apply to a COA: the literal oracle only understands plain substrings."""
+    return [engine for engine in ENGINES if engine != 'oracle' or is_plain_coa(coa_df)]
+
+
+def run_engine(engine, df, coa_df, checks_df, coa_key_df):
+    """Map with one engine and render the three output files as CSV text, as map_expense.py writes them
+    (with --provenance's RULE_ID kept in the mapped file, so the matching rule is compared too)."""
+    mapped, non_mapped = ENGINES[engine](df.copy(), coa_df, checks_df)
+    mapped = assign_account_names(mapped, coa_key_df.copy())
+    return {
+        'Mapped_Transactions.csv': format_amounts(mapped).to_csv(index=False),
+        'Non_Mapped_Transactions.csv': format_amounts(non_mapped).to_csv(index=False),
+        'Expense.csv': format_amounts(group_expenses(mapped.drop(columns='RULE_ID'))).to_csv(index=False),
+    }
+
+
+def first_difference(expected, actual):
+    """Describe the first differing line of two CSV texts, or None if they are equal."""
+    if expected == actual:
+        return None
+    expected_lines = expected.splitlines()
+    actual_lines = actual.splitlines()
+    for number, (want, got) in enumerate(zip(expected_lines, actual_lines), start=1):
+        if want != got:
+            return f"line {number}:\n  expected: {want}\n  actual:   {got}"
+    return f"expected {len(expected_lines)} lines, got {len(actual_lines)}"
+
+
+def assert_same_outputs(expected, actual, label):
+    for name in OUTPUTS:
+        difference = first_difference(expected[name], actual[name])
+        assert difference is None, f"{label}: {name} differs at {difference}"
+
+
+# ---------------------------------------------------------------------------
+# Generators
+# ---------------------------------------------------------------------------
+
+def random_phrase(rng, low=1, high=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def generate_coa(rng, n_rules=40, plain=False):
+    """A COA that deliberately contains prefixes, extensions, duplicates and all rule kinds
+    (only plain substrings without conditions when plain is set)."""
+    rows = []
+    texts = []
+    for _ in range(n_rules):
+        roll = rng.random()
+        if texts and roll < 0.15:
+            text = rng.choice(texts) + ' ' + rng.choice(WORDS)             # Extends an earlier rule
+        elif texts and roll < 0.25:
+            base = rng.choice(texts)
+            text = base[:rng.randint(1, len(base))]                         # Prefix of an earlier rule
+        elif texts and roll < 0.30:
+            text = rng.choice(texts)                                        # Exact duplicate
+        else:
+            text = random_phrase(rng)
+        texts.append(text)
+
+        kind = 1.0 if plain else rng.random()
+        if kind < 0.12:
+            description = 'ws:' + text.replace(' ', rng.choice([' ', '  ']))
+        elif kind < 0.22:
+            description = 're:' + rng.choice([f'^{text}', f'{text}\\s*#?\\d+', f'(?i){text.lower()}',
+                                               f'{text}$', f'(?:{text}|{random_phrase(rng, 1, 1)})'])
+        else:
+            description = text
+
+        row = {'EXPENSE': rng.choice(KEYS), 'DESCRIPTION': description}
+        if not plain:
+            row.update({'AMOUNT_MIN': '', 'AMOUNT_MAX': '', 'DETAILS': '', 'TYPE': ''})
+            if rng.random() < 0.12:
+                row['AMOUNT_MIN' if rng.random() < 0.5 else 'AMOUNT_MAX'] = \
+                    f'{rng.randint(-300, 300)}.{rng.randint(0, 99):02d}'
+            if rng.random() < 0.08:
+                row['DETAILS'] = rng.choice(['DEBIT', 'CREDIT', 'debit|dslip'])
+            if rng.random() < 0.05:
+                row['TYPE'] = rng.choice(TYPES)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def pattern_text(description):
+    """Literal text behind a rule, for building descriptions around it."""
+    for prefix in ('ws:', 're:'):
+        if description.startswith(prefix):
+            description = description[len(prefix):]
+    return ''.join(char for char in description if char.isalnum() or char in ' &:')
+
+
+def near_miss(rng, text):
+    """A variant of text that may or may not still match: edits, case, spacing, truncation."""
+    if not text:
+        return text
+    position = rng.randrange(len(text))
+    variants = [
+        text[:position] + text[position + 1:],                          # Deleted character
+        text[:position] + rng.choice('XZ#9 ') + text[position + 1:],    # Substituted character
+        text.lower(),
+        text.replace(' ', rng.choice(['  ', '\t', ''])),
+        text[:-1],
+        text[1:],
+    ]
+    return rng.choice(variants)
+
+
+def generate_description(rng, patterns):
+    """A description that embeds, overlaps or nearly matches the COA patterns, or is noise."""
+    roll = rng.random()
+    text = pattern_text(rng.choice(patterns)) if patterns else ''
+    if roll < 0.35:
+        return f'{random_phrase(rng, 0, 2)} {text} {rng.randint(0, 99999)}'.strip()
+    if roll < 0.55:
+        other = pattern_text(rng.choice(patterns))
+        return (text[:rng.randint(0, len(text))] + other[rng.randint(0, len(other)):] + other).strip() or 'X'
+    if roll < 0.80:
+        return f'{near_miss(rng, text)} {rng.choice(WORDS)}'.strip()
+    if roll < 0.90:
+        return f'CHECK {rng.randint(1000, 1010)}'
+    return random_phrase(rng, 1, 4) + f' #{rng.randint(0, 9999):04d}'
+
+
+def generate_transactions(rng, coa_df, n_rows):
+    """Canonical-column transactions as load_transactions returns them (Amount in cents)."""
+    patterns = coa_df['DESCRIPTION'].astype(str).tolist()
+    rows = []
+    for _ in range(n_rows):
+        description = generate_description(rng, patterns)
+        check = re.fullmatch(r'CHECK (\d+)', description)
+        is_check = check is not None and rng.random() < 0.8
+        rows.append({
+            'Details': 'CHECK' if is_check else rng.choice(DETAILS),
+            'Posting Date': f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024',
+            'Description': description,
+            'Amount': rng.randint(-50000, 50000),
+            'Type': 'CHECK_PAID' if is_check else rng.choice(TYPES),
+            'Balance': rng.randint(0, 10_000_000),
+            'Check': int(check.group(1)) if is_check else None,
+        })
+    df = pd.DataFrame(rows).astype({'Amount': 'int64', 'Balance': 'Int64', 'Check': 'Int64'})
+    return initialize_transaction_columns(df)
+
+
+def generate_checks(rng):
+    return pd.DataFrame({'CHECK': range(1000, 1006), 'EXPENSE': [rng.choice(KEYS) for _ in range(6)]})
+
+
+# ---------------------------------------------------------------------------
+# Golden corpus
+# ---------------------------------------------------------------------------
+
+def write_statement(df, path):
+    """Write canonical transactions as a Chase checking export (trailing empty field included)."""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Details', 'Posting Date', 'Description', 'Amount', 'Type', 'Balance', 'Check or Slip #'])
+        for row in format_amounts(df.drop(columns='KEY')).itertuples(index=False):
+            writer.writerow([row[0], row[1], row[2], row[3], row[4], row[5],
+                             '' if pd.isna(row[6]) else int(row[6]), ''])
+
+
+def load_golden_inputs():
+    df = initialize_transaction_columns(load_transactions(GOLDEN_STATEMENT, engine='c'))
+    return df, load_coa(GOLDEN_COA), load_checks(GOLDEN_CHECKS), load_coa_key(FILE_COA_KEY)
+
+
+def regenerate_golden(seed=2016, n_rows=600):
+    """Rebuild the golden corpus from the generators and the reference engine."""
+    rng = random.Random(seed)
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    generate_coa(rng, 60).to_csv(GOLDEN_COA, index=False)
+    generate_checks(rng).to_csv(GOLDEN_CHECKS, index=False)
+    write_statement(generate_transactions(rng, load_coa(GOLDEN_COA), n_rows), GOLDEN_STATEMENT)
+
+    for name, text in run_engine('reference', *load_golden_inputs()).items():
+        with open(os.path.join(GOLDEN_DIR, name), 'w', newline='') as file:
+            file.write(text)
+    print(f"✅ Golden corpus written to {GOLDEN_DIR}")
+
+
+def read_golden_outputs():
+    outputs = {}
+    for name in OUTPUTS:
+        with open(os.path.join(GOLDEN_DIR, name), newline='') as file:
+            outputs[name] = file.read()
+    return outputs
+
+
+# ---------------------------------------------------------------------------
+# Tests
+# ---------------------------------------------------------------------------
+
+def test_golden_corpus_all_engines():
+    inputs = load_golden_inputs()
+    golden = read_golden_outputs()
+    for engine in engines_for(inputs[1]):
+        assert_same_outputs(golden, run_engine(engine, *inputs), f"golden corpus, {engine} engine")
+
+
+def assert_same_frames(expected, actual, label):
+    """Frames hold the same values and dtypes; NaN / NA / None all count as missing."""
+    assert list(expected.columns) == list(actual.columns), f"{label}: columns differ"
+    for column in expected.columns:
+        want = expected[column].astype(object).where(expected[column].notna(), None)
+        got = actual[column].astype(object).where(actual[column].notna(), None)
+        assert want.equals(got), f"{label}: {column} differs: {want[want != got].head(3).tolist()} vs " \
+                                 f"{got[want != got].head(3).tolist()}"
+        if isinstance(expected[column].dtype, pd.CategoricalDtype) or pd.api.types.is_integer_dtype(expected[column]):
+            assert expected[column].dtype == actual[column].dtype, f"{label}: {column} dtype differs"
+
+
+def test_reader_engines_load_same_frames():
+    if not pyarrow_available():
+        return
+    blank_cells = ("Details,Posting Date,Description,Amount,Type,Balance,Check or Slip #\n"
+                   "DEBIT,01/02/2024,COSTCO,-1.00,DEBIT_CARD,,,\n"
+                   ",01/03/2024,,2.50,,10.00,,\n")
+    with tempfile.TemporaryDirectory() as folder:
+        blank_statement = os.path.join(folder, 'blank.csv')
+        with open(blank_statement, 'w', newline='') as file:
+            file.write(blank_cells)
+        for path in (GOLDEN_STATEMENT, blank_statement):
+            frames = [initialize_transaction_columns(load_transactions(path, engine=engine))
+                      for engine in ('c', 'pyarrow')]
+            assert_same_frames(*frames, f"{os.path.basename(path)}, c vs pyarrow reader")
+
+
+def check_random_corpora(expected_engine, seeds, plain=False):
+    """Generate a corpus per seed and compare every applicable engine with expected_engine."""
+    coa_key_df = load_coa_key(FILE_COA_KEY)
+    for seed in seeds:
+        rng = random.Random(seed)
+        coa_df = load_coa(io.StringIO(generate_coa(rng, plain=plain).to_csv(index=False)))    # As read from the file
+        checks_df = load_checks_frame(generate_checks(rng))
+        df = generate_transactions(rng, coa_df, 300)
+
+        expected = run_engine(expected_engine, df, coa_df, checks_df, coa_key_df)
+        for engine in engines_for(coa_df):
+            if engine != expected_engine:
+                assert_same_outputs(expected, run_engine(engine, df, coa_df, checks_df, coa_key_df),
+                                    f"seed {seed}, {engine} engine vs {expected_engine}")
+
+
+def test_random_corpora_engines_agree():
+    check_random_corpora('reference', range(20))
+
+
+def test_plain_corpora_match_literal_oracle():
+    check_random_corpora('oracle', range(100, 110), plain=True)
+
+
+def load_checks_frame(checks):
+    """Run a generated check table through load_checks, as if read from Checks.txt."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'Checks.txt')
+        checks.to_csv(path, index=False)
+        return load_checks(path)
+
+
+def test_smoke_benchmark():
+    results = benchmark(n_rows=3000)
+    assert all(result['identical'] for result in results.values())
+
+
+def benchmark(n_rows=20000, seed=7):
+    """Time every engine on one generated corpus and check that their outputs agree."""
+    rng = random.Random(seed)
+    coa_df = load_coa(GOLDEN_COA)
+    df = generate_transactions(rng, coa_df, n_rows)
+    checks_df = load_checks(GOLDEN_CHECKS)
+    coa_key_df = load_coa_key(FILE_COA_KEY)
+
+    results = {}
+    expected = None
+    for engine in engines_for(coa_df):
+        start = time.perf_counter()
+        outputs = run_engine(engine, df, coa_df, checks_df, coa_key_df)
+        seconds = time.perf_counter() - start
+        expected = expected or outputs
+        results[engine] = {'seconds': seconds, 'rows_per_sec': n_rows / seconds,
+                           'identical': all(first_difference(expected[name], outputs[name]) is None
+                                            for name in OUTPUTS)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differential mapping test and smoke benchmark.")
+    parser.add_argument('--benchmark', action='store_true', help="Time each engine on a generated statement")
+    parser.add_argument('--rows', type=int, default=20000, help="Rows for --benchmark")
+    parser.add_argument('--regenerate', action='store_true', help="Rebuild test/golden with the reference engine")
+    args = parser.parse_args()
+
+    if args.regenerate:
+        regenerate_golden()
+    elif args.benchmark:
+        results = benchmark(args.rows)
+        reference = results['reference']['seconds']
+        print(f"\n📊 {args.rows:,} rows")
+        print(f"{'engine':<12}{'seconds':>10}{'rows/sec':>12}{'speedup':>10}  outputs")
+        for engine, result in results.items():
+            print(f"{engine:<12}{result['seconds']:>10.3f}{result['rows_per_sec']:>12,.0f}"
+                  f"{reference / result['seconds']:>9.1f}x  {'identical' if result['identical'] else 'DIFFERENT'}")
+    else:
+        test_reader_engines_load_same_frames()
+        test_golden_corpus_all_engines()
+        test_random_corpora_engines_agree()
+        test_plain_corpora_match_literal_oracle()
+        print("✅ All engines match the reference mapper and the literal oracle.")
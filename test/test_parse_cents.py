@@ -0,0 +1,60 @@
+"""
+parse_cents must turn every money format the banks export into exact integer cents.
+
+Run with pytest, or directly:
+    python test/test_parse_cents.py
+"""
+
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_expense import parse_cents, format_cents, normalize_transactions
+from bank_formats import identify_bank_format
+
+
+def cents(values):
+    return [None if pd.isna(value) else int(value) for value in parse_cents(pd.Series(values, dtype=object))]
+
+
+def test_plain_values():
+    assert cents(['-1234.56', '12', '0.10', '.5', '', None]) == [-123456, 1200, 10, 50, None, None]
+
+
+def test_sign_anywhere():
+    assert cents(['$-12.00', '12.00-', '-$1,234.56', '(4.10)', '$(4.10)', '$12.00']) == \
+        [-1200, -1200, -123456, -410, -410, 1200]
+
+
+def test_sub_cent_rounds_half_up():
+    assert cents(['5.675', '-5.675', '5.674', '1,000.005']) == [568, -568, 567, 100001]
+
+
+def test_invalid_values_are_na():
+    assert cents(['1.2.3', 'abc', '.', '$']) == [None, None, None, None]
+
+
+def test_numeric_columns_are_dollars():
+    assert parse_cents(pd.Series([12, -3, 0])).tolist() == [1200, -300, 0]
+    assert parse_cents(pd.Series([12.5, None])).tolist() == [1250, pd.NA]
+
+
+def test_whole_dollar_debit_credit_export():
+    # pd.read_csv gives int64 columns when a Debit/Credit export has only whole dollars
+    raw = pd.DataFrame({'Date': ['01/02/2024', '01/03/2024'], 'Description': ['FUEL', 'REFUND'],
+                        'Debit': [12, 0], 'Credit': [0, 5]})
+    normalized = normalize_transactions(raw, identify_bank_format(raw.columns))
+    assert normalized['Amount'].tolist() == [1200, -500]
+
+
+def test_round_trip():
+    values = ['-1234.56', '0.01', '-0.01', '100.00']
+    assert list(format_cents(parse_cents(pd.Series(values)))) == values
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"✅ {name}")
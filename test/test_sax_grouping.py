@@ -0,0 +1,43 @@
+"""
+sax.py must total the mapped cents per KEY and write them to Expense.csv as dollars.
+
+sax.py builds its Tk window at import, so only expense_totals is loaded from its source.
+
+Run with pytest, or directly:
+    python test/test_sax_grouping.py
+"""
+
+import ast
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from map_expense import format_amounts
+
+SAX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sax.py')
+
+
+def load_expense_totals():
+    with open(SAX_FILE, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), SAX_FILE)
+    function = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'expense_totals']
+    namespace = {'pd': pd}
+    exec(compile(ast.Module(body=function, type_ignores=[]), SAX_FILE, 'exec'), namespace)
+    return namespace['expense_totals']
+
+
+def test_expense_totals_stay_in_cents():
+    expense_totals = load_expense_totals()
+    key = pd.DataFrame({'KEY': [10, 20, 30], 'ACCOUNT': ['Office', 'Travel', 'Unused']})
+    mapped = pd.DataFrame({'KEY': [10, 10, 20], 'Amount': pd.array([-12000, -350, 4000], dtype='Int64')})
+
+    expense_sum = expense_totals(mapped, key)
+    assert str(expense_sum['Amount'].dtype) == 'Int64'
+    assert expense_sum['Amount'].tolist() == [12350]
+    assert format_amounts(expense_sum)['Amount'].tolist() == ['123.50']
+
+
+if __name__ == '__main__':
+    test_expense_totals_stay_in_cents()
+    print('✅ sax grouping tests passed')
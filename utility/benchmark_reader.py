@@ -0,0 +1,122 @@
+"""
+Benchmark statement CSV reader engines: parse time and peak resident memory.
+
+Generates a synthetic Chase checking export (default 1 GB) and loads it with
+- legacy  → pd.read_csv(path), the path map_expense used before load_transactions
+- c       → load_transactions(path, engine='c')
+- pyarrow → load_transactions(path, engine='pyarrow')
+
+Each engine runs in its own subprocess so peak RSS is measured in isolation.
+
+Usage:
+    python utility/benchmark_reader.py --size-mb 1024
+    python utility/benchmark_reader.py --file my_export.CSV --engines c,pyarrow
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+HEADER = "Details,Posting Date,Description,Amount,Type,Balance,Check or Slip #\n"
+MERCHANTS = ['AMZN Mktp US*{ref}', 'COSTCO WHSE #{num} HAYWARD CA', 'CHEVRON {num} TRACY CA',
+             'ORIG CO NAME:PG&E ORIG ID:{ref} DESC DATE:{num} CO ENTRY DESCR:WEB ONLINE',
+             'HOME DEPOT #{num} SAN LEANDRO CA', 'ZELLE PAYMENT TO CONTRACTOR {num}', 'CHECK {num}']
+
+
+def generate_statement(path, size_mb):
+    """Write a synthetic Chase checking export of roughly size_mb megabytes."""
+    random.seed(2016)
+    block = []
+    for _ in range(10000):
+        merchant = random.choice(MERCHANTS)
+        description = merchant.format(ref=f'{random.getrandbits(32):08X}', num=random.randint(1, 99999))
+        is_check = merchant.startswith('CHECK')
+        details = 'CHECK' if is_check else random.choice(['DEBIT', 'DEBIT', 'CREDIT'])
+        amount = random.randint(1, 500000) / 100 * (-1 if details != 'CREDIT' else 1)
+        check = str(random.randint(1000, 9999)) if is_check else ''
+        block.append(f'{details},{random.randint(1, 12):02d}/{random.randint(1, 28):02d}/2024,'
+                     f'"{description}",{amount:.2f},ACH_DEBIT,{random.randint(0, 9999999) / 100:.2f},{check},\n')
+    block = ''.join(block)
+
+    target = size_mb * 1024 * 1024
+    with open(path, 'w') as file:
+        file.write(HEADER)
+        written = len(HEADER)
+        while written < target:
+            file.write(block)
+            written += len(block)
+
+
+def run_child(engine, path):
+    """Load the file with one engine and print timing/memory as JSON (runs in a subprocess)."""
+    import pandas as pd
+    import map_expense
+
+    start = time.perf_counter()
+    if engine == 'legacy':
+        df = pd.read_csv(path)
+        parse_seconds = time.perf_counter() - start
+        df = map_expense.preprocess_amounts(df)
+    else:
+        # load_transactions already returns Amount/Balance in cents
+        df = map_expense.load_transactions(path, engine=engine)
+        parse_seconds = time.perf_counter() - start
+    total_seconds = time.perf_counter() - start
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+    print(json.dumps({
+        'engine': engine,
+        'rows': len(df),
+        'parse_seconds': round(parse_seconds, 2),
+        'total_seconds': round(total_seconds, 2),
+        'frame_mb': round(df.memory_usage(deep=True).sum() / 1024 / 1024, 1),
+        'max_rss_mb': round(max_rss_mb, 1),
+    }))
+
+
+def benchmark(path, engines):
+    """Run each engine in a fresh interpreter and collect its report."""
+    results = []
+    for engine in engines:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', engine, path],
+                                   capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {engine} failed: {completed.stderr.strip().splitlines()[-1:]}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark statement CSV reader engines.")
+    parser.add_argument('--file', help="Existing export to load (otherwise one is generated)")
+    parser.add_argument('--size-mb', type=int, default=1024, help="Size of the generated export")
+    parser.add_argument('--engines', default='legacy,c,pyarrow')
+    parser.add_argument('--child', nargs=2, metavar=('ENGINE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        sys.exit()
+
+    path = args.file
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), f'auto_tax_benchmark_{args.size_mb}mb.csv')
+        if not os.path.exists(path):
+            print(f"🔄 Generating {args.size_mb} MB statement: {path}")
+            generate_statement(path, args.size_mb)
+
+    print(f"📊 {path} ({os.path.getsize(path) / 1024 / 1024:.0f} MB)")
+    print(f"{'engine':<10}{'rows':>12}{'parse s':>10}{'total s':>10}{'frame MB':>10}{'peak RSS MB':>13}")
+    for result in benchmark(path, args.engines.split(',')):
+        print(f"{result['engine']:<10}{result['rows']:>12,}{result['parse_seconds']:>10}"
+              f"{result['total_seconds']:>10}{result['frame_mb']:>10}{result['max_rss_mb']:>13}")
@@ -0,0 +1,135 @@
+"""
+Compile Chart_Of_Accounts_Mappings.txt into a checked binary ruleset.
+
+- Validates every rule: regexes compile, EXPENSE is a KEY in Chart_Of_Accounts_Key.txt.
+- Removes rules that can never be the first match: exact duplicates and rules
+  shadowed by an earlier rule (e.g. "COSTCO WHSE" after "COSTCO"). The remaining
+  rules keep their file order, so every transaction maps exactly as before.
+- Reports rules that differ only in case or spacing. Matching is case and space
+  sensitive, so they are listed for review rather than merged.
+- Writes the ruleset (versioned binary, see coa_rules.py) for map_expense.py --ruleset,
+  and optionally the cleaned mappings as text.
+
+Unlike sort_COA_Key.py, rules are never reordered: the first match wins, so order is priority.
+
+Usage:
+    python utility/compile_COA.py
+    python utility/compile_COA.py --text-out data/coa/Chart_Of_Accounts_Mappings.clean.txt
+"""
+
+import os
+import re
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from map_expense import load_coa, load_coa_key
+from coa_rules import compile_coa, build_ruleset, save_ruleset, source_digest, RULESET_EXTENSION
+
+COA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'coa')
+FILE_COA = os.path.join(COA_DIR, 'Chart_Of_Accounts_Mappings.txt')
+FILE_COA_KEY = os.path.join(COA_DIR, 'Chart_Of_Accounts_Key.txt')
+
+
+def canonical(text):
+    """Case- and whitespace-folded form of a rule, used only to spot near duplicates."""
+    return ' '.join(text.upper().split())
+
+
+def same_conditions(first, second):
+    return all(first[key] == second[key] for key in ('amount_min', 'amount_max', 'details', 'type'))
+
+
+def shadows(earlier, later):
+    """True when every transaction matching the later rule already matches the earlier one."""
+    if earlier['kind'] == later['kind'] and earlier['text'] == later['text'] and same_conditions(earlier, later):
+        return True
+    if earlier['conditional'] or earlier['kind'] == 'regex':
+        return False            # Conditions and anchors depend on more than the matched text
+    if later['kind'] == 'substring':
+        # Any description containing the later text contains a match of the earlier rule
+        return earlier['regex'].search(later['text']) is not None
+    if later['kind'] == 'ws' and earlier['kind'] == 'substring' and not re.search(r'\s', earlier['text']):
+        # Whitespace-free text inside one word of the later rule is in every description it matches
+        return any(earlier['text'] in word for word in later['text'][3:].split())
+    return False
+
+
+def remove_dead_rules(rules):
+    """Drop rules that can never win, keeping the order of the rest."""
+    kept = []
+    removed = []
+    for rule in rules:
+        shadow = next((earlier for earlier in kept if shadows(earlier, rule)), None)
+        if shadow is None:
+            kept.append(rule)
+            continue
+        removed.append(rule)
+        what = 'duplicate of' if shadow['text'] == rule['text'] else 'shadowed by'
+        conflict = '' if shadow['expense'] == rule['expense'] else f" (EXPENSE {rule['expense']} vs {shadow['expense']})"
+        print(f"⚠️ line {rule['line']} {rule['text']!r} is {what} line {shadow['line']} {shadow['text']!r}{conflict}")
+    return kept, removed
+
+
+def validate_keys(rules, coa_key_df):
+    """Return an error message for every rule whose EXPENSE is not a KEY in the key file."""
+    keys = set(coa_key_df['KEY'].astype(str).str.strip())
+    errors = []
+    for rule in rules:
+        expense = str(rule['expense']).strip()
+        if not re.fullmatch(r'-?\d+', expense):
+            errors.append(f"line {rule['line']} {rule['text']!r}: EXPENSE {expense!r} is not a number")
+        elif str(int(expense)) not in keys:
+            errors.append(f"line {rule['line']} {rule['text']!r}: EXPENSE {expense} is not in the COA key file")
+    return errors
+
+
+def report_near_duplicates(rules):
+    seen = {}
+    for rule in rules:
+        first = seen.setdefault((rule['kind'], canonical(rule['text'])), rule)
+        if first is not rule:
+            print(f"ℹ️ line {rule['line']} {rule['text']!r} differs from line {first['line']} "
+                  f"{first['text']!r} only in case or spacing")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate, de-duplicate and compile the COA mappings.")
+    parser.add_argument('--coa', default=FILE_COA)
+    parser.add_argument('--key', default=FILE_COA_KEY)
+    parser.add_argument('--out', help="Binary ruleset path (default: the mappings file with a "
+                                      f"{RULESET_EXTENSION} extension)")
+    parser.add_argument('--text-out', help="Also write the cleaned mappings as text")
+    args = parser.parse_args()
+
+    coa_df = load_coa(args.coa)
+    coa_key_df = load_coa_key(args.key)
+    if coa_df is None or coa_key_df is None:
+        sys.exit(1)
+
+    try:
+        rules = compile_coa(coa_df)['rules']
+    except (ValueError, re.error) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    errors = validate_keys(rules, coa_key_df)
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        print(f"❌ {len(errors)} rules failed validation. No ruleset written.")
+        sys.exit(1)
+
+    kept, removed = remove_dead_rules(rules)
+    report_near_duplicates(kept)
+
+    out = args.out or os.path.splitext(args.coa)[0] + RULESET_EXTENSION
+    save_ruleset(build_ruleset(kept), out, source_digest(args.coa))
+    print(f"✅ {len(kept)} rules compiled ({len(removed)} removed) → {out}")
+
+    if args.text_out:
+        lines = {rule['line'] for rule in kept}
+        cleaned = coa_df[coa_df.index.isin(lines)]
+        cleaned.to_csv(args.text_out, index=False)
+        print(f"📄 Cleaned mappings saved: {args.text_out}")
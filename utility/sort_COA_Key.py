@@ -1,3 +1,5 @@
+# Note: sorting changes which rule matches first (first match wins). To clean up the
+# mappings without changing results, use utility/compile_COA.py instead.
 import pandas as pd
 file_coa = "Chart_Of_Accounts_Mappings.txt"
 coa = pd.read_csv(file_coa, encoding='latin1', thousands=',')
@@ -0,0 +1,249 @@
+"""
+================================================================================
+ Watch-Folder Mode
+================================================================================
+ Description:  Watches a drop folder and maps every new statement CSV as it
+               lands, instead of launching map_expense.py and picking each file
+               through select_transaction_file.
+
+ How it works:
+ - The folder is polled; a file is picked up once its size and mtime are
+   unchanged between two polls and it is at least --settle seconds old, so
+   statements still being copied are left alone.
+ - Each file's SHA-256 is recorded in the state file; a statement whose
+   content was already processed (even under another name) is skipped.
+ - The compiled COA rules and the check table stay loaded between files and are
+   reloaded only when their files change.
+
+ File Outputs (in --output, default next to this script):
+ - Expense.csv              → running KEY / ACCOUNT / Amount totals over every
+                              processed statement.
+ - Non_Mapped_Backlog.csv   → non-mapped rows appended per statement, with
+                              the statement name in Source.
+ - watch_state.json         → seen hashes and the running totals in cents,
+                              plus the backlog size before a statement's rows
+                              are appended, so a crash mid-statement is rolled
+                              back on restart instead of duplicating rows.
+
+================================================================================
+"""
+
+
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime
+import pandas as pd
+from map_expense import (load_transactions, initialize_transaction_columns, load_coa, load_checks,
+                         map_transactions, group_expenses, format_amounts)
+from coa_rules import compile_coa
+from mapping_daemon import file_signature
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FILE_COA = os.path.join(HERE, 'data', 'coa', 'Chart_Of_Accounts_Mappings.txt')
+FILE_CHECKS = os.path.join(HERE, 'data', 'coa', 'Checks.txt')
+STATE_FILE = 'watch_state.json'
+BACKLOG_FILE = 'Non_Mapped_Backlog.csv'
+STATEMENT_EXTENSIONS = ('.csv',)
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_atomic(path, text):
+    """Write text to path through a temporary file so readers never see half a file."""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8', newline='') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+def load_state(state_path):
+    """Load the watch state (seen hashes, running totals), or start a new one."""
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error loading watch state {state_path}: {e}")
+            raise
+    return {'seen': {}, 'totals': {}}
+
+
+def save_state(state, state_path):
+    write_atomic(state_path, json.dumps(state, indent=2, sort_keys=True))
+
+
+def load_rules(rules, file_coa=FILE_COA, file_checks=FILE_CHECKS):
+    """Return the compiled COA and check table, reloading only the files that changed.
+
+    If the changed COA fails to compile the previous rules are kept.
+    """
+    signature = (file_signature(file_coa), file_signature(file_checks))
+    if rules and rules['signature'] == signature:
+        return rules
+
+    coa_df = load_coa(file_coa)
+    if coa_df is None:
+        return rules
+
+    try:
+        compiled = compile_coa(coa_df)
+    except (ValueError, KeyError, re.error) as e:
+        print(f"❌ Error compiling COA file {file_coa}: {e}")
+        if rules is None:
+            return None
+        print("⚠️ Keeping the previous rules.")
+        # Remember the broken files so they are not recompiled on every poll
+        return {**rules, 'signature': signature}
+    return {'compiled': compiled, 'checks': load_checks(file_checks), 'signature': signature}
+
+
+def stable_files(folder, pending, settle_seconds):
+    """Statement files whose size/mtime held still since the last poll and are old enough.
+
+    pending maps path → last seen (mtime_ns, size) and is updated in place.
+    """
+    ready = []
+    now = time.time()
+    current = {}
+    for entry in os.scandir(folder):
+        if not entry.is_file() or not entry.name.lower().endswith(STATEMENT_EXTENSIONS):
+            continue
+        signature = file_signature(entry.path)
+        if signature is None:
+            continue
+        current[entry.path] = signature
+        if pending.get(entry.path) == signature and now - signature[0] / 1e9 >= settle_seconds:
+            ready.append(entry.path)
+
+    pending.clear()
+    pending.update(current)
+    return sorted(ready)
+
+
+def update_expenses(state, output_dir):
+    """Rewrite Expense.csv from the running totals."""
+    totals = pd.DataFrame({'KEY': list(state['totals']), 'Amount': list(state['totals'].values())})
+    expense_sum = group_expenses(totals.astype({'Amount': 'int64'}))
+    write_atomic(os.path.join(output_dir, 'Expense.csv'), format_amounts(expense_sum).to_csv(index=False))
+
+
+def append_backlog(non_mapped_df, source, output_dir):
+    """Append a statement's non-mapped rows to the unmapped backlog."""
+    if non_mapped_df.empty:
+        return
+    backlog_path = os.path.join(output_dir, BACKLOG_FILE)
+    rows = format_amounts(non_mapped_df.assign(Source=source))
+    rows.to_csv(backlog_path, mode='a', index=False, header=not os.path.exists(backlog_path))
+
+
+def recover_backlog(state, output_dir):
+    """Drop backlog rows appended for a statement that was never recorded as processed."""
+    pending = state.pop('pending', None)
+    if pending is None:
+        return
+    backlog_path = os.path.join(output_dir, BACKLOG_FILE)
+    if os.path.exists(backlog_path) and os.path.getsize(backlog_path) > pending['backlog_size']:
+        if pending['backlog_size']:
+            os.truncate(backlog_path, pending['backlog_size'])
+        else:
+            os.remove(backlog_path)
+        print(f"🔄 Removed the partial backlog rows of {pending['file']}; it will be mapped again.")
+
+
+def process_statement(path, digest, rules, state, output_dir, state_path):
+    """Map one statement and fold it into the running totals and backlog."""
+    source = os.path.basename(path)
+    df = initialize_transaction_columns(load_transactions(path))
+    mapped_df, non_mapped_df = map_transactions(df, rules['compiled'], rules['checks'])
+
+    sums = mapped_df.groupby(mapped_df['KEY'].astype(str))['Amount'].sum()
+    # Record where the backlog ends first, so rows appended before a crash can be cut off on restart
+    backlog_path = os.path.join(output_dir, BACKLOG_FILE)
+    state['pending'] = {'file': source,
+                        'backlog_size': os.path.getsize(backlog_path) if os.path.exists(backlog_path) else 0}
+    save_state(state, state_path)
+    append_backlog(non_mapped_df, source, output_dir)
+
+    for key, cents in sums.items():
+        state['totals'][key] = state['totals'].get(key, 0) + int(cents)
+    state['seen'][digest] = {
+        'file': source,
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+        'rows': len(df),
+        'mapped': len(mapped_df),
+        'non_mapped': len(non_mapped_df),
+    }
+    del state['pending']
+    save_state(state, state_path)
+    update_expenses(state, output_dir)
+    print(f"✅ {source}: {len(mapped_df)} mapped, {len(non_mapped_df)} added to the backlog.")
+
+
+def watch(folder, output_dir=HERE, interval=2.0, settle_seconds=5.0, once=False):
+    """Poll folder and map each new, fully written statement exactly once."""
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = load_state(state_path)
+    if 'pending' in state:
+        recover_backlog(state, output_dir)
+        save_state(state, state_path)
+    pending = {}
+    handled = {}        # path → signature already processed or skipped, so it is not hashed again
+    rules = None
+
+    print(f"👀 Watching {folder} (every {interval:g}s, settle {settle_seconds:g}s)")
+    try:
+        while True:
+            for path in stable_files(folder, pending, settle_seconds):
+                if handled.get(path) == pending[path]:
+                    continue
+                handled[path] = pending[path]
+
+                digest = file_sha256(path)
+                if digest in state['seen']:
+                    print(f"ℹ️ Skipping {os.path.basename(path)}: already processed as {state['seen'][digest]['file']}")
+                    continue
+
+                rules = load_rules(rules)
+                if rules is None:
+                    print("❌ COA file could not be loaded. Waiting for the next poll.")
+                    del handled[path]
+                    continue
+                try:
+                    process_statement(path, digest, rules, state, output_dir, state_path)
+                except Exception as e:
+                    print(f"❌ Error processing {path}: {e}")
+                    if 'pending' in state:
+                        recover_backlog(state, output_dir)
+                        save_state(state, state_path)
+
+            if once and pending and all(handled.get(path) == sig for path, sig in pending.items()):
+                break
+            if once and not pending:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("🛑 Watch stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map new statements as they land in a folder.")
+    parser.add_argument('folder', help="Drop folder to watch")
+    parser.add_argument('--output', default=HERE, help="Where Expense.csv, the backlog and the state file go")
+    parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls")
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help="Seconds a file must stay unchanged before it is mapped")
+    parser.add_argument('--once', action='store_true', help="Map what is in the folder now, then exit")
+    args = parser.parse_args()
+
+    watch(args.folder, args.output, args.interval, args.settle, args.once)